@@ -16,15 +16,31 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from rpi_ws281x import PixelStrip
-
-from ola.ClientWrapper import ClientWrapper as OLAClientWrapper
-from ola.DMXConstants import DMX_UNIVERSE_SIZE
-from RPi import GPIO
+import numpy as np
 import threading
+from time import perf_counter_ns
+
+from activity import ActivityLED
+from backends import ClientWrapper as OLAClientWrapper, GPIO, PixelStrip
+from backends import DMX_UNIVERSE_SIZE
+from color import ColorCorrection
+from compositor import Compositor
+from frames import FrameAssembler
+from framebus import FrameBusSource
+from layout import Layout
+from log import log
+from metrics import Metrics, StatsWriter
+from output import OutputThread
+from palette import PALETTE_SIZE
+from recording import DMXRecorder
+from routing import compile_routes
+from startup import StartupTimer
 
 STATUS_LED = 17
 
+# Blinks on the DMX packets and key presses
+status_led = ActivityLED(STATUS_LED)
+
 
 class ClientWrapper(OLAClientWrapper):
     def Execute(self, f):
@@ -37,23 +53,117 @@ class LEDPanel:
     start_universe: The universe in which the panel starts
     start_channel: Inside the start_universe, the first channel used by the
                     panel. Internally numbered starting from 0.
+    hold_time: How long to wait for the other universes of a frame before
+               showing it anyway, in ms.
+    fps: Maximum number of frames pushed to the LEDs per second.
+    columns, rows: Size of the panel, both default to `size`.
+    layout: How the LEDs are wired, see layout.Layout.
+    correction: Gamma, white balance and dimmer, see color.ColorCorrection.
+
+    pin, strip_channel, dma: GPIO pin, PWM channel and DMA channel of the
+                             strip, see rpi_ws281x.PixelStrip.
+    wrapper, client: OLA ClientWrapper and client to share with other
+                     panels, see driver.PanelDriver, or a
+                     receiver.DMXReceiver to do without OLA. By default, the
+                     panel creates its own OLA ClientWrapper.
+    startup: StartupTimer timing the initialization. The strip and the
+             connection to OLA are initialized concurrently.
+    palette: None, or a palette.Palette to use one channel per pixel, the
+             index of its color in the palette, instead of three. See
+             bindPalette() to set the colors from DMX.
+    zones: None, or a zones.Zones grouping the pixels into zones of one
+           color each, three channels per zone. Can't be used with a
+           palette.
+    packing: How the pixels are spread over the universes, see
+             routing.compile_routes(): 'rows' never splits a row between
+             universes, 'pixels' uses every universe as fully as possible.
+
+    The live DMX and the macros are drawn into the layers of `compositor`:
+    `live_layer` at the bottom, `macro_layer`, hidden by default, over it.
     """
-    def __init__(self, universe, channel, size=17):
+    def __init__(self, universe, channel, size=17, hold_time=10, fps=60,
+                 columns=None, rows=None, layout=Layout(), correction=None,
+                 pin=12, strip_channel=0, dma=10, wrapper=None, client=None,
+                 startup=None, palette=None, zones=None, packing='rows'):
         self.address_lock = threading.Lock()
         self.start_universe = universe
         self.start_channel = channel - 1
-        self._rows = size
-        self._columns = self._rows  # We assume it's a square
+        self._rows = rows if rows is not None else size
+        self._columns = columns if columns is not None else size
+        self.palette = palette
+        self._channels_per_pixel = 3 if palette is None else 1
+        self._packing = packing
+        if zones is not None:
+            if palette is not None:
+                raise ValueError('zones can not be used with a palette')
+            self._zone_table, self._input_columns, self._input_rows = zones.compile(
+                self._columns, self._rows)
+        else:
+            self._zone_table = None
+            self._input_columns, self._input_rows = self._columns, self._rows
 
         self._old_universes = {}
+        self._universe_routes = {}
+        self._callbacks = {}
+        self.recorder = None
+        self.metrics = Metrics()
 
         self.updateUniversesChannels()
 
-        self._strip = PixelStrip(num=self._led_count, pin=12)  # uses PWM0
-        self._strip.begin()
-
-        self._wrapper = ClientWrapper()
-        self._client = self._wrapper.Client()
+        def beginStrip():
+            # pin 12 uses PWM0
+            strip = PixelStrip(num=self._led_count, pin=pin, dma=dma,
+                               channel=strip_channel)
+            strip.begin()
+            return strip
+
+        startup = startup if startup is not None else StartupTimer()
+        started = startup.parallel(
+            strip=beginStrip,
+            ola=lambda: wrapper if wrapper is not None else ClientWrapper())
+        self._strip = started['strip']
+
+        self.compositor = Compositor(self._led_count)
+        self.live_layer = self.compositor.addLayer('dmx')
+        self.macro_layer = self.compositor.addLayer('macro', level=0)
+        # The universes are decoded into the staging buffer, copied into the
+        # live layer once their frame is complete: RGB pixels, palette
+        # indices or zone colors
+        if palette is not None:
+            self._staging = np.zeros(self._input_count, dtype=np.uint8)
+        else:
+            self._staging = np.zeros((self._input_count, 3), dtype=np.uint8)
+        # Palette indices of the live layer's pixels, as np.take() wants them
+        self._indices = np.zeros(self._input_count, dtype=np.intp)
+        self._controls = {}
+        self._control_values = {}
+        self._subscribed = set()
+
+        self.correction = correction if correction is not None else ColorCorrection()
+        self._output = OutputThread(self._strip, self.compositor, fps,
+                                    layout.compile(self._columns, self._rows),
+                                    self.correction, self.metrics)
+        self._output.start()
+
+        self._owns_wrapper = wrapper is None
+        self._wrapper = started['ola']
+        # Thread running the wrapper, known once it handles its first event
+        self._wrapper_thread = None
+        self._wrapper.Execute(self._wrapperStarted)
+        self._client = client if client is not None else self._wrapper.Client()
+
+        self.assembler = FrameAssembler(self._universes(), self._commitFrame,
+                                        self._wrapper.AddEvent, hold_time)
+
+        if hasattr(self._client, 'RegisterSync'):
+            self._client.RegisterSync(self.assembler.sync)
+
+        self.metrics.watch('frames_complete', lambda: self.assembler.complete_frames)
+        self.metrics.watch('frames_partial', lambda: self.assembler.partial_frames)
+        self.metrics.watch('frames_unchanged', lambda: self.assembler.unchanged_frames)
+        self.metrics.watch('frames_shown', lambda: self._output.shown_frames)
+        self.metrics.watch('frames_dropped', lambda: self._output.dropped_frames)
+        self.metrics.watch('log_dropped', lambda: log.dropped)
 
         self.subscribeToUniverses()
 
@@ -66,109 +176,287 @@ class LEDPanel:
         return self._rows
 
     def getCallbackForUniverse(self, universe):
-        if universe == self.start_universe:
-            first_channel = self.start_channel
-            last_channel = self._last_channel_used_in_first_universe + 1
-
-            first_pixel_index = 0
-        elif universe == self._last_universe:
-            first_channel = 0
-            last_channel = self._last_channel + 1
-
-            first_pixel_index = self._led_count - (
-                self._rows_in_last_universe * self._columns)
-        elif universe > self.start_universe and universe < self._last_universe:
-            first_channel = 0
-            last_channel = self._last_channel + 1
-
-            internal_universe_index = universe - self.start_universe
-            pixels_in_first = self._rows_in_first_universe * self._columns
-            pixels_in_full = self._rows_per_full_universe * self._columns
-            first_pixel_index = pixels_in_first + (
-                (internal_universe_index - 1) * pixels_in_full)
-        else:
-            raise ValueError('universe must be one of the listened universes')
-
-        strip = self._strip
+        route = self._routes.get(universe)
+        if route is None:
+            if universe not in self._controls:
+                raise ValueError('universe must be one of the listened universes')
+            controls = self._getControlCallback(universe)
+            return lambda data: controls(np.asarray(data, dtype=np.uint8))
+        first_channel, last_channel = route.first_channel, route.last_channel
+        first_pixel_index = route.first_pixel
+        end_pixel_index = first_pixel_index + route.pixel_count
+        pixels = self._staging[first_pixel_index:end_pixel_index].reshape(-1)
+        assembler = self.assembler
         old_universes = self._old_universes
+        metrics = self.metrics
+        controls = self._getControlCallback(universe)
 
         def callback(data):
-            data = list(data)[first_channel:last_channel]
-
-            if universe not in old_universes or data != old_universes[universe]:
-                old_universes[universe] = data
-
-                GPIO.output(STATUS_LED, GPIO.HIGH)
+            start = perf_counter_ns()
+            channels = np.asarray(data, dtype=np.uint8)
+            if controls is not None:
+                controls(channels)
+            channels = channels[first_channel:last_channel]
+            raw = channels.tobytes()
+            received = perf_counter_ns()
+
+            changed = old_universes.get(universe) != raw
+            diffed = perf_counter_ns()
+
+            metrics.count('packets_received')
+            metrics.record('receive', received - start)
+            metrics.record('diff', diffed - received)
+
+            if changed:
+                # The previous frame can't get the data of the next one
+                assembler.begin(universe)
+                old_universes[universe] = raw
+                status_led.pulse()
+
+                used = min(channels.size, pixels.size)
+                pixels[:used] = channels[:used]
+                pixels[used:] = 0
+                metrics.record('decode', perf_counter_ns() - diffed)
+                log.debug("Universe {} changed", universe, sample=100)
+
+            assembler.received(universe, changed)
 
-                for i in range(0, last_channel - first_channel, 3):
-                    try:
-                        r = data[i]
-                    except IndexError:
-                        r = 0
+        return callback
 
-                    try:
-                        g = data[i+1]
-                    except IndexError:
-                        g = 0
+    def _commitFrame(self):
+        """Copies the frame assembled in the staging buffer into the live
+        layer and publishes it. Called by the assembler, on the same thread
+        as the universe callbacks, so that universes of the next frame never
+        reach the frame being shown."""
+        live_pixels = self.live_layer.pixels
+        with self.compositor.lock:
+            if self.palette is not None:
+                np.copyto(self._indices, self._staging)
+                self.palette.expand(self._indices, live_pixels)
+            elif self._zone_table is not None:
+                np.take(self._staging, self._zone_table, axis=0, out=live_pixels,
+                        mode='clip')
+            else:
+                np.copyto(live_pixels, self._staging)
+        self._output.publish()
+
+    def _getControlCallback(self, universe):
+        """Callback calling the controls bound to `universe` when their
+        channels change, None if there is none"""
+        controls = self._controls.get(universe)
+        if not controls:
+            return None
+        values = self._control_values
+        publish = self._output.publish
+
+        def callback(channels):
+            changed = False
+            for channel, count, setter in controls:
+                if count is None:
+                    value = int(channels[channel]) if channel < channels.size else 0
+                else:
+                    value = channels[channel:channel + count].tobytes()
+                if values.get((universe, channel, count)) != value:
+                    values[(universe, channel, count)] = value
+                    setter(value if count is None else np.frombuffer(value, np.uint8))
+                    changed = True
+            if changed:
+                publish()
 
-                    try:
-                        b = data[i+2]
-                    except IndexError:
-                        b = 0
+        return callback
 
-                    strip.setPixelColorRGB(int(i/3)+first_pixel_index, r, g, b)
-                strip.show()
-                print(universe)
+    def bindControl(self, universe, channel, setter, count=None):
+        """Calls setter(value) whenever the DMX `channel` of `universe`
+        changes. `channel` starts at 1.
 
-                GPIO.output(STATUS_LED, GPIO.LOW)
+        If `count` is given, calls setter(channels) with the array of the
+        `count` channels starting at `channel` whenever one of them changes.
+        This method is threadsafe, see setAddress().
+        """
+        def bind():
+            self._controls.setdefault(universe, []).append((channel - 1, count, setter))
+            self.subscribeToUniverses()
 
-        return callback
+        with self.address_lock:
+            self._callOnWrapperThread(bind)
+
+    def bindPalette(self, universe, channel, count=None):
+        """Sets the first `count` colors of the palette from DMX, as RGB
+        channels starting at `channel`. By default, as many colors as fit
+        in the rest of the universe, at most PALETTE_SIZE."""
+        if self.palette is None:
+            raise ValueError('the panel has no palette')
+        fitting = (DMX_UNIVERSE_SIZE - (channel - 1)) // 3
+        if count is None:
+            count = min(fitting, PALETTE_SIZE)
+        elif count > fitting:
+            raise ValueError('{} colors from channel {} do not fit in a universe'.format(
+                count, channel))
+        self.bindControl(universe, channel, self._setPalette, count * 3)
+
+    def _setPalette(self, channels):
+        if self.palette.setColors(0, channels):
+            with self.compositor.lock:
+                self.palette.expand(self._indices, self.live_layer.pixels)
+
+    def bindLayerAmount(self, layer, universe, channel):
+        """Drives the amount of `layer` from a DMX channel"""
+        self.bindControl(universe, channel,
+                         lambda value: setattr(layer, 'amount', value / 255))
+
+    def setLayerAmount(self, layer, amount):
+        """Sets how much of `layer` is blended, between 0 and 1"""
+        layer.amount = amount
+        self._output.publish()
+
+    def fadeLayer(self, layer, level, duration=0):
+        """Fades the level of `layer` in `duration` ms"""
+        layer.fadeTo(level, duration)
+        self._output.publish()
 
     def updateUniversesChannels(self):
+        """Compiles the routing table of the current address"""
         self._led_count = self._rows * self._columns
-        self._channel_count_per_row = self._columns * 3
-
-        self._rows_per_full_universe = DMX_UNIVERSE_SIZE // self._channel_count_per_row
-        channels_in_first_universe = DMX_UNIVERSE_SIZE - self.start_channel
-        self._rows_in_first_universe = channels_in_first_universe \
-            // self._channel_count_per_row
-
-        self._last_channel_used_in_first_universe = self.start_channel + \
-            self._rows_in_first_universe * self._channel_count_per_row - 1
-
-        self._universe_count = 1
-        rows_left = self._rows - self._rows_in_first_universe
-        while rows_left >= self._rows_per_full_universe:
-            self._universe_count += 1
-            rows_left -= self._rows_per_full_universe
-
-        if rows_left != 0:
-            self._universe_count += 1
-            self._last_channel = rows_left * self._channel_count_per_row - 1
-            self._rows_in_last_universe = rows_left
-        else:
-            self._last_channel = DMX_UNIVERSE_SIZE
+        # Pixels received over DMX, the zones in zone mode
+        self._input_count = self._input_rows * self._input_columns
 
-        self._last_universe = self.start_universe + self._universe_count - 1
+        self._routes = compile_routes(self.start_universe, self.start_channel,
+                                      self._input_columns, self._input_rows,
+                                      self._channels_per_pixel, self._packing)
+        self._last_universe = self.start_universe + len(self._routes) - 1
+
+    def _universes(self):
+        return range(self.start_universe, self._last_universe + 1)
 
     def subscribeToUniverses(self):
-        self._old_universes.clear()
-        for uni in range(self.start_universe, self._last_universe + 1):
-            self._client.RegisterUniverse(uni, self._client.REGISTER,
-                                          self.getCallbackForUniverse(uni))
+        """Listens to the panel's universes and to the control universes
+
+        Only the universes not listened to yet are registered, and only the
+        ones not used anymore are unregistered. A universe still carrying
+        the same part of the image keeps its last data, and the LEDs keep
+        showing the current frame until new data arrives.
+        """
+        wanted = set(self._universes()) | set(self._controls)
+        for uni in sorted(self._subscribed - wanted):
+            self._client.RegisterUniverse(uni, self._client.UNREGISTER,
+                                          data_callback=None)
+            self._forgetUniverse(uni)
+
+        self.assembler.setUniverses(self._universes())
+        for uni in sorted(wanted):
+            route = self._routes.get(uni)
+            if self._universe_routes.get(uni) != route:
+                self._old_universes.pop(uni, None)
+                self._universe_routes[uni] = route
+            self._callbacks[uni] = self.getCallbackForUniverse(uni)
+            if uni not in self._subscribed:
+                self._client.RegisterUniverse(uni, self._client.REGISTER,
+                                              self._getDispatcher(uni))
+        self._subscribed = wanted
 
     def unsubscribeFromUniverses(self):
-        for uni in range(self.start_universe, self._last_universe + 1):
+        for uni in sorted(self._subscribed):
             self._client.RegisterUniverse(uni, self._client.UNREGISTER,
                                           data_callback=None)
+            self._forgetUniverse(uni)
+        self._subscribed = set()
+
+    def _forgetUniverse(self, universe):
+        self._callbacks.pop(universe, None)
+        self._old_universes.pop(universe, None)
+        self._universe_routes.pop(universe, None)
+        for key in [key for key in self._control_values if key[0] == universe]:
+            del self._control_values[key]
+
+    def _getDispatcher(self, universe):
+        """Data callback registered once per universe, calling its current
+        callback, so that re-addressing the panel needs no new registration"""
+        callbacks = self._callbacks
+
+        def dispatch(data):
+            recorder = self.recorder
+            if recorder is not None:
+                recorder.record(universe, data)
+            callback = callbacks.get(universe)
+            if callback is not None:
+                callback(data)
+
+        return dispatch
+
+    def _wrapperStarted(self):
+        self._wrapper_thread = threading.current_thread()
+
+    def _callOnWrapperThread(self, f):
+        """Calls f() on the wrapper's thread, where the DMX is handled, and
+        waits for it, re-raising its exception. Calls it right away when the
+        wrapper doesn't run, or from the wrapper's thread."""
+        thread = self._wrapper_thread
+        if thread is None or thread is threading.current_thread():
+            return f()
+
+        done = threading.Event()
+        errors = []
+
+        def call():
+            try:
+                f()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                done.set()
+        self._wrapper.Execute(call)
+        done.wait()
+        if errors:
+            raise errors[0]
+
+    def injectDMX(self, universe, data):
+        """Handles `data` as if it was received on `universe`, e.g. to replay
+        a recording, see recording.DMXReplay. Ignored if the panel does not
+        listen to `universe`.
+
+        This method is threadsafe: `data` is copied, then handled on the
+        wrapper's thread, like the DMX received, once the panel runs.
+        """
+        data = np.array(data, dtype=np.uint8)
+
+        def inject():
+            callback = self._callbacks.get(universe)
+            if callback is not None:
+                callback(data)
+        self._wrapper.Execute(inject)
+
+    def startRecording(self, path):
+        """Appends the DMX received from now on to the recording at `path`,
+        see recording.DMXRecorder"""
+        self.stopRecording()
+        self.recorder = DMXRecorder(path)
+
+    def stopRecording(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
 
     def run(self):
-        print("Launched LEDPanel")
+        log.info("Launched LEDPanel")
         self._wrapper.Run()
 
+    def stop(self):
+        """Stops listening to OLA, unless the wrapper is shared, and stops the
+        output thread once the last frame is shown"""
+        self._wrapper_thread = None
+        if self._owns_wrapper:
+            self._wrapper.Stop()
+        self.stopRecording()
+        self._output.stop()
+
     def setOnOff(self, activate=True):
         self._strip.setBrightness(activate * 255)
-        self._strip.show()
+        self._output.publish()
+
+    def setDimmer(self, value):
+        """Sets the master dimmer, between 0 and 255"""
+        self.correction.dimmer = value
+        self._output.publish()
 
     def threadSafeSchedule(self, time_in_ms, callback):
         def f():
@@ -178,36 +466,65 @@ class LEDPanel:
     def setAddress(self, universe=None, channel=None):
         """Sets the panel's address
 
-        This method is threadsafe
+        Only the universes entering or leaving the address range are
+        registered or unregistered, see subscribeToUniverses().
+        This method is threadsafe: the panel is re-addressed on the wrapper's
+        thread, between two packets, and it returns once it is done.
         """
-        with self.address_lock:
-            universe = universe if universe is not None else self.start_universe
-            channel = channel - 1 if channel is not None else self.start_channel
-
-            self.unsubscribeFromUniverses()
-
-            self.start_universe = universe
-            self.start_channel = channel
+        def readdress():
+            self.start_universe = universe if universe is not None \
+                else self.start_universe
+            self.start_channel = channel - 1 if channel is not None \
+                else self.start_channel
 
             self.updateUniversesChannels()
             self.subscribeToUniverses()
 
-    def showFrame(self, frame):
-        for i, pixel in enumerate(frame):
-            self._strip.setPixelColorRGB(i, *pixel)
-        self._strip.show()
+        with self.address_lock:
+            self._callOnWrapperThread(readdress)
+
+    def attachFrameBus(self, bus, layer=None):
+        """Shows the frames published on `bus`, a framebus.FrameBus of the
+        panel's size, in `layer`, a new layer over the others by default.
+        Returns the layer."""
+        if layer is None:
+            layer = self.compositor.addLayer('bus')
+        self._output.addSource(FrameBusSource(bus, layer))
+        return layer
+
+    def setPreviewBus(self, bus):
+        """Publishes every frame shown on `bus`, a framebus.FrameBus of the
+        panel's size, None to stop"""
+        if bus is not None and (bus.columns, bus.rows) != (self._columns, self._rows):
+            raise ValueError('the bus is {}x{}, the panel is {}x{}'.format(
+                bus.columns, bus.rows, self._columns, self._rows))
+        self._output.preview = bus
+
+    def showFrame(self, frame, layer=None):
+        """Draws `frame`, an RGB array such as Macro.frame, or a list of
+        (r, g, b) tuples, into `layer`, the macro layer by default"""
+        layer = layer if layer is not None else self.macro_layer
+        frame = np.asarray(frame, dtype=np.uint8).reshape(-1, 3)
+        with self.compositor.lock:
+            layer.pixels[...] = frame
+        self._output.publish()
 
 
 if __name__ == '__main__':
-    panel = LEDPanel(universe=0, channel=1)
-    try:
-
-        GPIO.setmode(GPIO.BCM)
-
-        GPIO.setup(STATUS_LED, GPIO.OUT)
-        GPIO.output(STATUS_LED, GPIO.LOW)
+    startup = StartupTimer()
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(STATUS_LED, GPIO.OUT)
+    GPIO.output(STATUS_LED, GPIO.LOW)
 
+    panel = LEDPanel(universe=0, channel=1, startup=startup)
+    try:
+        startup.report(panel.metrics)
+        StatsWriter(panel.metrics).start()
         panel.run()
     finally:
+        log.info("Frames: {} complete, {} partial",
+                 panel.assembler.complete_frames, panel.assembler.partial_frames)
         panel.setOnOff(False)
+        panel.stop()
+        status_led.stop()
         GPIO.cleanup()
@@ -18,14 +18,18 @@
 
 from datetime import datetime, timedelta
 import math
+import queue
+import socket
 import threading
-import subprocess
-
-from ola.DMXConstants import DMX_UNIVERSE_SIZE
-from RPi import GPIO
-from RPLCD.i2c import CharLCD
-
-from LedPanel import STATUS_LED
+import time
+
+from backends import CharLCD, DMX_UNIVERSE_SIZE, GPIO
+from display import ShadowLCD
+from LedPanel import STATUS_LED, status_led
+from log import log
+from metrics import Metrics, StatsWriter
+from playback import MacroPlayer
+import effects
 import macros
 
 UP_BUTTON = 26
@@ -33,13 +37,27 @@ DOWN_BUTTON = 6
 OK_BUTTON = 19
 BACK_BUTTON = 13
 
+BOUNCE_TIME = 20  # ms
+# Holding UP or DOWN repeats it every REPEAT_INTERVAL s after REPEAT_DELAY s,
+# by steps growing with the time it has been held: (held for, step)
+REPEAT_DELAY = 0.5
+REPEAT_INTERVAL = 0.1
+REPEAT_STEPS = ((4, 100), (2, 10), (0, 1))
+
 
 class fakepanel:
     def __init__(self):
         self.threadSafeSchedule = lambda a, b: None
         self.start_universe = 0
         self.start_channel = 1
+        self.columns = self.rows = 17
         self.setOnOff = lambda a: None
+        self.setDimmer = lambda a: None
+        self.setLayerAmount = lambda a, b: None
+        self.fadeLayer = lambda a, b, c: None
+        self.showFrame = lambda a: None
+        self.macro_layer = None
+        self.metrics = Metrics()
 
     def setAddress(self, universe=None, channel=None):
         pass
@@ -47,9 +65,42 @@ class fakepanel:
     def run(self):
         input()
 
+    def stop(self):
+        pass
+
 
 def get_ip_address():
-    return subprocess.check_output(["hostname", "-i"]).decode().split(' ')[0]
+    """Address of the interface routing to the network, None if there is no
+    route yet, no packet is sent"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect(('10.255.255.255', 1))
+        return sock.getsockname()[0]
+    except OSError:
+        return None
+    finally:
+        sock.close()
+
+
+def open_lcd():
+    """Opens the LCD and loads its custom characters"""
+    lcd = CharLCD(i2c_expander='PCF8574', address=0x3F, cols=20, rows=4,
+                  auto_linebreaks=False, backlight_enabled=False)
+
+    lcd.cursor_mode = 'hide'
+
+    # UP/DOWN arrow. Use as char \x00
+    lcd.create_char(0, (
+        0b00100,
+        0b01110,
+        0b11111,
+        0b00000,
+        0b00000,
+        0b11111,
+        0b01110,
+        0b00100
+        ))
+    return lcd
 
 
 class ParentalError(ValueError):
@@ -57,6 +108,9 @@ class ParentalError(ValueError):
 
 
 class Screen:
+    # Whether holding UP or DOWN repeats them
+    repeatable = False
+
     def __init__(self, scr_id, showname, manager):
         self.scr_id = scr_id
         self.showname = showname
@@ -140,6 +194,18 @@ class Screen:
     def onDown(self):
         pass
 
+    def onRepeat(self, up, step):
+        """Called while UP (`up` True) or DOWN is held, if the screen is
+        repeatable. `step` grows the longer the button is held."""
+        if up:
+            self.onUp()
+        else:
+            self.onDown()
+
+    def onRelease(self):
+        """Called when UP or DOWN is released"""
+        pass
+
 
 class StartScreen(Screen):
     """A Start screen
@@ -177,6 +243,8 @@ class EndScreen(Screen):
 
 class MenuScreen(Screen):
     """A Menu Screen"""
+    repeatable = True
+
     onOK = Screen.gotoSelectedChild
 
     onBack = Screen.gotoParent
@@ -195,37 +263,62 @@ class ValueScreen(EndScreen):
 
     `initial` is the default value taken by this screen
     `minimum` and `maximum` are the allowed boundaries for the value
+    If `live` is set, the value is applied each time UP or DOWN is
+    released, else only on OK. BACK goes back to the last value set with OK.
     """
-    def __init__(self, scr_id, showname, manager, initial, minimum, maximum):
+    repeatable = True
+
+    def __init__(self, scr_id, showname, manager, initial, minimum, maximum,
+                 live=False):
         super(ValueScreen, self).__init__(scr_id, showname, manager)
 
         self.value = initial
         self.old_value = initial
+        self.applied_value = initial
         self.minimum = minimum
         self.maximum = maximum
+        self.live = live
+
+    def apply(self):
+        """Calls the callback with the value, if it changed since last time"""
+        if self.value != self.applied_value:
+            self.applied_value = self.value
+            self.callback(self.value)
 
     def onOK(self):
-        self.callback(self.value)
+        self.apply()
         super(ValueScreen, self).onOK()
         self.old_value = self.value
 
     def onBack(self):
         self.value = self.old_value
+        if self.live:
+            self.apply()
         super(ValueScreen, self).onBack()
 
-    def onUp(self):
+    def onUp(self, step=1):
         if self.value == self.maximum:
             if math.isfinite(self.minimum):
                 self.value = self.minimum
         else:
-            self.value += 1
+            self.value = min(self.value + step, self.maximum)
 
-    def onDown(self):
+    def onDown(self, step=1):
         if self.value == self.minimum:
             if math.isfinite(self.maximum):
                 self.value = self.maximum
         else:
-            self.value -= 1
+            self.value = max(self.value - step, self.minimum)
+
+    def onRepeat(self, up, step):
+        if up:
+            self.onUp(step)
+        else:
+            self.onDown(step)
+
+    def onRelease(self):
+        if self.live:
+            self.apply()
 
     def computeDisplay(self):
         super(ValueScreen, self).computeDisplay()
@@ -265,24 +358,91 @@ class ToggleScreen(EndScreen):
 
 
 class InformationScreen(EndScreen):
-    """Shows a value"""
-    def __init__(self, scr_id, showname, manager, value):
+    """Shows a value
+
+    `value` can be a function, called each time the screen is shown until
+    it returns something else than None. `default` is shown meanwhile.
+    """
+    def __init__(self, scr_id, showname, manager, value, default=''):
         super(InformationScreen, self).__init__(scr_id, showname, manager)
         self.value = value
+        self.default = default
 
     def computeDisplay(self):
         super(InformationScreen, self).computeDisplay()
-        self.second_line = self.value[:20]
+        value = self.value
+        if callable(value):
+            value = value()
+            if value is None:
+                value = self.default
+            else:
+                self.value = value
+        self.second_line = value[:20]
+
+
+class StatsScreen(EndScreen):
+    """Shows the panel's metrics, one per page
+
+    UP and DOWN go through the pages
+    """
+    COUNTERS = (
+        ('Trames completes', 'frames_complete'),
+        ('Trames partielles', 'frames_partial'),
+        ('Trames inchangees', 'frames_unchanged'),
+        ('Trames perdues', 'frames_dropped'),
+        ('Paquets recus', 'packets_received'),
+        )
+    HISTOGRAMS = (
+        ('Reception', 'receive'),
+        ('Comparaison', 'diff'),
+        ('Decodage', 'decode'),
+        ('Rendu', 'render'),
+        ('Affichage', 'show'),
+        ('Gigue macro', 'macro_jitter'),
+        )
+
+    def __init__(self, scr_id, showname, manager, metrics):
+        super(StatsScreen, self).__init__(scr_id, showname, manager)
+        self.metrics = metrics
+        self.page = 0
+
+    def onUp(self):
+        self.page = (self.page + 1) % (len(self.COUNTERS) + len(self.HISTOGRAMS))
+
+    def onDown(self):
+        self.page = (self.page - 1) % (len(self.COUNTERS) + len(self.HISTOGRAMS))
+
+    def computeDisplay(self):
+        snapshot = self.metrics.snapshot()
+        if self.page < len(self.COUNTERS):
+            title, name = self.COUNTERS[self.page]
+            value = str(snapshot['counters'].get(name, 0))
+        else:
+            title, name = self.HISTOGRAMS[self.page - len(self.COUNTERS)]
+            histogram = snapshot['histograms'].get(name)
+            if histogram is None:
+                value = '-'
+            else:
+                value = 'p50 {} max {}us'.format(histogram['p50_us'],
+                                                 histogram['max_us'])
+        self.first_line = title[:20]
+        self.second_line = '\x00' + value[:19]
 
 
 class MacroScreen(EndScreen):
-    """Screen used to run macros"""
-    def __init__(self, scr_id, showname, manager, macro, repeat=True):
+    """Screen used to run macros
+
+    The macro is drawn in the panel's macro layer, faded in and out over
+    `fade_time` ms.
+    """
+    def __init__(self, scr_id, showname, manager, macro, repeat=True, fade_time=500):
         super(MacroScreen, self).__init__(scr_id, showname, manager)
         self.macro = macro
         self.running = False
         self.repeat = repeat
+        self.fade_time = fade_time
         self.panel = self.manager.panel
+        self.player = None
 
     def onOK(self):
         if self.running:
@@ -308,37 +468,18 @@ class MacroScreen(EndScreen):
     def _run(self):
         self.running = True
 
-        self.panel.unsubscribeFromUniverses()
-
-        self.panel.threadSafeSchedule(
-            self.macro.step_length,
-            self._run_callback
-            )
-
-    def _run_callback(self):
-        if not self.running:
-            return
-
-        try:
-            frame = next(self.macro)
-        except StopIteration:
-            if self.repeat:
-                frame = next(self.macro)
-            else:
-                self._stop()
-
-        # send the frame to the panel
-        self.panel.showFrame(frame)
-
-        self.panel.threadSafeSchedule(
-            self.macro.step_length,
-            self._run_callback
-            )
+        self.player = MacroPlayer(self.macro, self.panel.showFrame, self.repeat,
+                                  on_end=self._stop, metrics=self.panel.metrics)
+        self.player.start()
+        self.panel.fadeLayer(self.panel.macro_layer, 1, self.fade_time)
 
     def _stop(self):
         self.running = False
+        self.panel.fadeLayer(self.panel.macro_layer, 0, self.fade_time)
+        if self.player is not None:
+            self.player.stop()
+            self.player = None
         self.macro.reset()
-        self.panel.subscribeToUniverses()
         self.manager.updateScreen()
 
     onDown = _stop
@@ -349,9 +490,11 @@ class ScreenManager:
 
     Creates the arborescence needed for a LedPanel and manages it
 
+    `lcd` is the LCD from open_lcd(), opened by the manager if not given.
+
     Please call cleanup() once you have finished.
     """
-    def __init__(self, panel):
+    def __init__(self, panel, lcd=None):
         self.panel = panel
 
         self.lcd_lock = threading.RLock()
@@ -362,17 +505,39 @@ class ScreenManager:
         main_menu = MenuScreen('MAIN_MENU', 'Menu', self)
         manual_menu = MenuScreen('MANUAL_MENU', 'Manuel', self)
         universe_selector = ValueScreen('UNIVERSE_SELECTOR', 'Choix Univers', self,
-                                        self.panel.start_universe, 0, math.inf)
+                                        self.panel.start_universe, 0, math.inf,
+                                        live=True)
         channel_selector = ValueScreen('CHANNEL_SELECTOR', 'Choix Adresse', self,
-                                       self.panel.start_channel+1, 1, DMX_UNIVERSE_SIZE)
+                                       self.panel.start_channel+1, 1, DMX_UNIVERSE_SIZE,
+                                       live=True)
         blackout = ToggleScreen('BLACKOUT', 'Blackout', self)
+        dimmer = ValueScreen('DIMMER', 'Luminosite', self, 255, 0, 255, live=True)
+        macro_mix = ValueScreen('MACRO_MIX', 'Mixage macro', self, 255, 0, 255,
+                                live=True)
         test_pattern = MacroScreen('TEST_PATTERN', 'Test leds', self,
-                                   macros.TestPixels(panel.columns, panel.rows))
-        ip_info = InformationScreen('IP_INFO', 'Adresse IP', self, get_ip_address())
+                                   macros.CachedMacro(
+                                       macros.TestPixels(panel.columns, panel.rows)))
+        effects_menu = MenuScreen('EFFECTS_MENU', 'Effets', self)
+        effect_screens = [
+            MacroScreen('PLASMA', 'Plasma', self,
+                        effects.Plasma(panel.columns, panel.rows)),
+            MacroScreen('GRADIENT', 'Arc-en-ciel', self,
+                        effects.Gradient(panel.columns, panel.rows)),
+            MacroScreen('NOISE', 'Bruit', self, effects.Noise(panel.columns, panel.rows)),
+            MacroScreen('FIRE', 'Feu', self, effects.Fire(panel.columns, panel.rows)),
+            MacroScreen('TEXT', 'Texte', self,
+                        effects.ScrollingText(panel.columns, panel.rows)),
+            ]
+        ip_info = InformationScreen('IP_INFO', 'Adresse IP', self, get_ip_address,
+                                    'Pas de reseau')
+        stats = StatsScreen('STATS', 'Statistiques', self, self.panel.metrics)
 
         universe_selector.setCallback(lambda uni: self.panel.setAddress(universe=uni))
         channel_selector.setCallback(lambda chan: self.panel.setAddress(channel=chan))
         blackout.setCallback(lambda off: self.panel.setOnOff(not off))
+        dimmer.setCallback(self.panel.setDimmer)
+        macro_mix.setCallback(
+            lambda value: self.panel.setLayerAmount(self.panel.macro_layer, value / 255))
 
         home.addChild(main_menu)
 
@@ -380,65 +545,118 @@ class ScreenManager:
         main_menu.addChild(channel_selector)
         main_menu.addChild(manual_menu)
         main_menu.addChild(ip_info)
+        main_menu.addChild(stats)
 
         manual_menu.addChild(blackout)
+        manual_menu.addChild(dimmer)
         manual_menu.addChild(test_pattern)
+        manual_menu.addChild(macro_mix)
+        manual_menu.addChild(effects_menu)
+
+        for screen in effect_screens:
+            effects_menu.addChild(screen)
 
         self.current = home
 
         with self.lcd_lock:
-            self.lcd = CharLCD(i2c_expander='PCF8574', address=0x3F, cols=20, rows=4,
-                               auto_linebreaks=False, backlight_enabled=False)
-
-            self.lcd.cursor_mode = 'hide'
-
-            # UP/DOWN arrow. Use as char \x00
-            self.lcd.create_char(0, (
-                0b00100,
-                0b01110,
-                0b11111,
-                0b00000,
-                0b00000,
-                0b11111,
-                0b01110,
-                0b00100
-                ))
+            self.lcd = lcd if lcd is not None else open_lcd()
 
+            self.display = ShadowLCD(self.lcd, self.lcd_lock)
+            self.display.start()
             self.updateScreen()
             #self.backlightOn()
 
     def listenToGPIO(self):
+        """Queues the button presses and releases, and handles them from the
+        UI thread"""
+        self.events = queue.Queue()
+        self._ui_thread = threading.Thread(target=self._handleEvents, name='UIThread',
+                                           daemon=True)
+        self._ui_thread.start()
+
         for pin in [UP_BUTTON, DOWN_BUTTON, OK_BUTTON, BACK_BUTTON]:
             GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
             GPIO.add_event_detect(
-                pin, GPIO.RISING,
+                pin, GPIO.BOTH,
                 callback=self.getGPIOCallback(),
-                bouncetime=200
+                bouncetime=BOUNCE_TIME
                 )
 
     def getGPIOCallback(self):
         def GPIOCallback(channel):
-            with self.gpio_lock:
-                GPIO.output(STATUS_LED, GPIO.HIGH)
-                #self.backlightOn()
-
-                if channel == UP_BUTTON:
-                    print("UP", channel)
-                    self.current.onUp()
-                elif channel == DOWN_BUTTON:
-                    print("DOWN", channel)
-                    self.current.onDown()
-                elif channel == OK_BUTTON:
-                    print("OK", channel)
-                    self.current.onOK()
-                elif channel == BACK_BUTTON:
-                    print("BACK", channel)
-                    self.current.onBack()
-                self.updateScreen()
-
-                GPIO.output(STATUS_LED, GPIO.LOW)
+            # Buttons pull their pin to the ground when pressed
+            self.events.put((channel, GPIO.input(channel) == GPIO.LOW,
+                             time.monotonic()))
         return GPIOCallback
 
+    def _handleEvents(self):
+        held = None
+        pressed_at = next_repeat = None
+        while True:
+            if held is None:
+                timeout = None
+            else:
+                timeout = max(next_repeat - time.monotonic(), 0)
+            try:
+                event = self.events.get(timeout=timeout)
+            except queue.Empty:
+                # Release edges can be lost to the debouncing: only repeat
+                # while the button is really held
+                if GPIO.input(held) != GPIO.LOW:
+                    held = None
+                    self.releaseButton()
+                    continue
+                held_for = time.monotonic() - pressed_at
+                step = next(step for after, step in REPEAT_STEPS if held_for >= after)
+                self.repeatButton(held, step)
+                next_repeat += REPEAT_INTERVAL
+                continue
+
+            if event is None:
+                break
+            channel, pressed, when = event
+            if pressed and held is None:
+                self.handleButton(channel)
+                if channel in (UP_BUTTON, DOWN_BUTTON):
+                    held = channel
+                    pressed_at = when
+                    next_repeat = when + REPEAT_DELAY
+            elif not pressed and channel == held:
+                held = None
+                self.releaseButton()
+
+    def handleButton(self, channel):
+        status_led.pulse()
+        with self.gpio_lock:
+            #self.backlightOn()
+
+            if channel == UP_BUTTON:
+                log.debug("UP {}", channel)
+                self.current.onUp()
+            elif channel == DOWN_BUTTON:
+                log.debug("DOWN {}", channel)
+                self.current.onDown()
+            elif channel == OK_BUTTON:
+                log.debug("OK {}", channel)
+                self.current.onOK()
+            elif channel == BACK_BUTTON:
+                log.debug("BACK {}", channel)
+                self.current.onBack()
+            self.updateScreen()
+
+    def repeatButton(self, channel, step):
+        """Repeats a held UP or DOWN `channel`"""
+        if not self.current.repeatable:
+            return
+        with self.gpio_lock:
+            self.current.onRepeat(channel == UP_BUTTON, step)
+            self.updateScreen()
+
+    def releaseButton(self):
+        with self.gpio_lock:
+            self.current.onRelease()
+            self.updateScreen()
+
     def backlightOn(self):
         self.on_time = datetime.now()
         with self.lcd_lock:
@@ -454,28 +672,43 @@ class ScreenManager:
                 self.lcd.backlight_enabled = False
 
     def updateScreen(self):
+        """Shows the current screen. Only the changed characters are sent
+        to the LCD, from the display's thread."""
         self.current.computeDisplay()
-
-        with self.lcd_lock:
-            self.lcd.clear()
-            self.lcd.write_string(self.current.first_line)
-            self.lcd.crlf()
-            self.lcd.write_string(self.current.second_line)
+        self.display.write(self.current.first_line, self.current.second_line)
 
     def cleanup(self):
         GPIO.cleanup()
+        if hasattr(self, 'events'):
+            self.events.put(None)
+            self._ui_thread.join()
+        self.display.stop()
         with self.lcd_lock:
             self.lcd.close(clear=True)
 
 
 if __name__ == '__main__':
     from LedPanel import LEDPanel
+    from startup import StartupTimer
 
+    startup = StartupTimer()
     GPIO.setmode(GPIO.BCM)
+    GPIO.setup(STATUS_LED, GPIO.OUT)
+    GPIO.output(STATUS_LED, GPIO.LOW)
+
+    # The LCD is set up while the panel starts.
+    # Use fakepanel() if you do not want the real panel to fire up.
+    started = startup.parallel(
+        panel=lambda: LEDPanel(universe=0, channel=1, startup=startup),
+        lcd=open_lcd)
+    panel = started['panel']
 
-    # panel = fakepanel()  # use this if you do not want the real panel to fire up.
-    panel = LEDPanel(universe=0, channel=1)
-    manager = ScreenManager(panel)
+    # Listen to DMX right away, the UI is set up meanwhile
+    panel_thread = threading.Thread(target=panel.run, name='PanelThread', daemon=True)
+    panel_thread.start()
+
+    with startup.phase('ui'):
+        manager = ScreenManager(panel, started['lcd'])
 
     try:
         #manager.backlightOn()
@@ -485,11 +718,11 @@ if __name__ == '__main__':
         manager.listenToGPIO()
         manager.updateScreen()
 
-        GPIO.setup(STATUS_LED, GPIO.OUT)
-        GPIO.output(STATUS_LED, GPIO.LOW)
-
-        panel.run()
+        startup.report(panel.metrics)
+        StatsWriter(panel.metrics).start()
+        panel_thread.join()
     finally:
-        GPIO.output(STATUS_LED, GPIO.LOW)
+        status_led.stop()
         manager.cleanup()
         panel.setOnOff(False)
+        panel.stop()
@@ -0,0 +1,74 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import threading
+import time
+
+from backends import GPIO
+
+
+class ActivityLED(threading.Thread):
+    """Blinks a LED when something happens, at most `rate` times per second
+
+    pulse() only raises a flag, so it can be called for every DMX packet or
+    key press: the LED is written by the thread, which blinks it once for
+    all the pulses since the last blink. The pin must be set up as an
+    output. The thread is started by the first pulse.
+    """
+    def __init__(self, pin, rate=10):
+        super(ActivityLED, self).__init__(name='ActivityLED', daemon=True)
+        self.pin = pin
+        self.half_period = 1 / (2 * rate)
+
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._launched = False
+        self._running = True
+
+        self.blinks = 0
+
+    def pulse(self):
+        if not self._wake.is_set():
+            self._wake.set()
+        if not self._launched:
+            self._startOnce()
+
+    def _startOnce(self):
+        with self._start_lock:
+            if not self._launched:
+                self._launched = True
+                self.start()
+
+    def stop(self):
+        """Stops the thread and turns the LED off"""
+        self._running = False
+        if self._launched:
+            self._wake.set()
+            self.join()
+        GPIO.output(self.pin, GPIO.LOW)
+
+    def run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if not self._running:
+                break
+            GPIO.output(self.pin, GPIO.HIGH)
+            time.sleep(self.half_period)
+            GPIO.output(self.pin, GPIO.LOW)
+            self.blinks += 1
+            time.sleep(self.half_period)
@@ -0,0 +1,53 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Picks the hardware and OLA implementations used by the panel.
+#
+# LEDPANEL_SIMULATE lists the backends to replace with the stand-ins from
+# simulation.py, separated by commas: strip, gpio, lcd, ola, or all.
+# e.g. LEDPANEL_SIMULATE=strip,ola python3 LedPanel.py
+
+import os
+
+SIMULATED = set(os.environ.get('LEDPANEL_SIMULATE', '').replace(',', ' ').split())
+
+
+def is_simulated(backend):
+    return backend in SIMULATED or 'all' in SIMULATED
+
+
+if is_simulated('strip'):
+    from simulation import PixelStrip
+else:
+    from rpi_ws281x import PixelStrip
+
+if is_simulated('gpio'):
+    from simulation import GPIO
+else:
+    from RPi import GPIO
+
+if is_simulated('lcd'):
+    from simulation import CharLCD
+else:
+    from RPLCD.i2c import CharLCD
+
+if is_simulated('ola'):
+    from simulation import ClientWrapper, DMX_UNIVERSE_SIZE
+else:
+    from ola.ClientWrapper import ClientWrapper
+    from ola.DMXConstants import DMX_UNIVERSE_SIZE
+
+__all__ = ['PixelStrip', 'GPIO', 'CharLCD', 'ClientWrapper', 'DMX_UNIVERSE_SIZE']
@@ -0,0 +1,378 @@
+#!/bin/env python3
+
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import array
+import contextlib
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+os.environ.setdefault('LEDPANEL_SIMULATE', 'all')
+
+import numpy as np  # noqa: E402
+
+from backends import is_simulated  # noqa: E402
+import effects  # noqa: E402
+from LedPanel import LEDPanel  # noqa: E402
+from palette import Palette  # noqa: E402
+from receiver import DMXReceiver, E131_PORT  # noqa: E402
+from recording import DMXRecording, replay  # noqa: E402
+from routing import PACKINGS  # noqa: E402
+from simulation import DMXSender  # noqa: E402
+
+# Metrics where a higher value is better, the others are better lower
+HIGHER_IS_BETTER = ('ingest_fps', 'output_fps')
+
+
+def random_universes(universes, count):
+    """`count` frames of random DMX data for each universe"""
+    return [{uni: array.array('B', random.choices(range(256), k=512))
+             for uni in universes} for _ in range(count)]
+
+
+def summarize(values):
+    values = np.asarray(values)
+    return {
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max()),
+        }
+
+
+def send_frame(client, frame):
+    for uni, data in frame.items():
+        client.send(uni, data)
+
+
+def benchmark_panel(size, channel, frame_count, duration, palette=False, packing='rows'):
+    panel = LEDPanel(universe=1, channel=channel, size=size, fps=1000,
+                     palette=Palette() if palette else None, packing=packing)
+    client = panel._client
+    wrapper_thread = threading.Thread(target=panel.run, daemon=True)
+    wrapper_thread.start()
+
+    universes = list(panel._universes())
+    frames = random_universes(universes, 16)
+    for frame in frames:
+        send_frame(client, frame)
+
+    latencies = []
+    start = time.perf_counter()
+    for i in range(frame_count):
+        for uni, data in frames[i % len(frames)].items():
+            t = time.perf_counter_ns()
+            client.send(uni, data)
+            latencies.append((time.perf_counter_ns() - t) / 1000)
+    ingest_fps = frame_count / (time.perf_counter() - start)
+
+    shown = panel._output.shown_frames
+    start = time.perf_counter()
+    i = 0
+    while time.perf_counter() - start < duration:
+        send_frame(client, frames[i % len(frames)])
+        i += 1
+    output_fps = (panel._output.shown_frames - shown) / (time.perf_counter() - start)
+
+    tracemalloc.start()
+    allocated = []
+    for i in range(frame_count):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        send_frame(client, frames[i % len(frames)])
+        _, peak = tracemalloc.get_traced_memory()
+        allocated.append(peak - before)
+    tracemalloc.stop()
+
+    panel.stop()
+    wrapper_thread.join()
+
+    return {
+        'size': size,
+        'start_channel': channel,
+        'mode': 'palette' if palette else 'rgb',
+        'packing': packing,
+        'universes': len(universes),
+        'callback_latency_us': summarize(latencies),
+        'ingest_fps': ingest_fps,
+        'output_fps': output_fps,
+        'allocated_bytes_per_frame': summarize(allocated),
+        }
+
+
+def benchmark_network(size, path, frame_count, host='127.0.0.1'):
+    """Latency from the first E1.31 packet of a frame sent over UDP to the
+    frame being pushed to the output thread
+
+    path: 'native' for receiver.DMXReceiver, 'ola' for olad, which must
+          have its E1.31 plugin listening on `host` and the universes patched
+    """
+    if path == 'native':
+        receiver = DMXReceiver(protocols=('e131',), e131_port=0)
+        panel = LEDPanel(universe=1, channel=1, size=size, fps=1000,
+                         wrapper=receiver, client=receiver.Client())
+        port = receiver.ports['e131']
+    else:
+        receiver = None
+        panel = LEDPanel(universe=1, channel=1, size=size, fps=1000)
+        port = E131_PORT
+    wrapper_thread = threading.Thread(target=panel.run, daemon=True)
+    wrapper_thread.start()
+
+    shown = threading.Event()
+    show_times = []
+    publish = panel.assembler._show
+
+    def show():
+        show_times.append(time.perf_counter_ns())
+        publish()
+        shown.set()
+    panel.assembler._show = show
+
+    sender = DMXSender(host, e131_port=port)
+    universes = list(panel._universes())
+    frames = random_universes(universes, 16)
+    latencies = []
+    lost = 0
+    for i in range(frame_count):
+        shown.clear()
+        del show_times[:]
+        start = time.perf_counter_ns()
+        for uni, data in frames[i % len(frames)].items():
+            sender.sendE131(uni, data)
+        if shown.wait(1):
+            latencies.append((show_times[0] - start) / 1000)
+        else:
+            lost += 1
+
+    sender.close()
+    panel.stop()
+    if receiver is not None:
+        receiver.Stop()
+    wrapper_thread.join()
+    if receiver is not None:
+        receiver.close()
+
+    return {
+        'size': size,
+        'path': path,
+        'universes': len(universes),
+        'frame_latency_us': summarize(latencies) if latencies else None,
+        'lost_frames': lost,
+        }
+
+
+def benchmark_replay(path, size):
+    """Replays the recording at `path` as fast as possible into a panel
+    starting at the first recorded universe"""
+    recording = DMXRecording(path)
+    universe = int(recording.universes.min()) if len(recording) else 0
+    panel = LEDPanel(universe=universe, channel=1, size=size, fps=1000)
+    wrapper_thread = threading.Thread(target=panel.run, daemon=True)
+    wrapper_thread.start()
+
+    shown = panel._output.shown_frames
+    start = time.perf_counter()
+    replay(recording, panel.injectDMX)
+    # The universes are handled on the wrapper's thread
+    handled = threading.Event()
+    panel._wrapper.Execute(handled.set)
+    handled.wait()
+    elapsed = time.perf_counter() - start
+
+    panel.stop()
+    wrapper_thread.join()
+    shown = panel._output.shown_frames - shown
+
+    return {
+        'size': size,
+        'recording': path,
+        'records': len(recording),
+        'recorded_s': recording.duration,
+        'replay_s': elapsed,
+        'records_per_s': len(recording) / elapsed if elapsed else 0,
+        'frames_shown': shown,
+        }
+
+
+def benchmark_effect(cls, size, frame_count):
+    """Compute time of the frames of an effect, with its budget check off"""
+    effect = cls(size, size, budget=math.inf)
+    times = []
+    for _ in range(frame_count):
+        start = time.perf_counter_ns()
+        next(effect)
+        times.append((time.perf_counter_ns() - start) / 1000)
+    compute = summarize(times)
+    return {
+        'effect': cls.__name__,
+        'size': size,
+        'compute_us': compute,
+        'max_fps': 1e6 / compute['p99'],
+        }
+
+
+def compare(results, baseline, tolerance):
+    """Returns the metrics of `results` worse than `baseline` by more than
+    `tolerance`"""
+    def key(result):
+        return (result['size'], result['start_channel'], result.get('mode', 'rgb'),
+                result.get('packing', 'rows'))
+
+    previous = {key(r): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        for metric in ('ingest_fps', 'output_fps', 'callback_latency_us'):
+            new_value, old_value = result[metric], old[metric]
+            if isinstance(new_value, dict):
+                new_value, old_value = new_value['p50'], old_value['p50']
+            if metric in HIGHER_IS_BETTER:
+                worse = new_value < old_value * (1 - tolerance)
+            else:
+                worse = new_value > old_value * (1 + tolerance)
+            if worse:
+                regressions.append('{}x{} @{} {} {}: {} {:.1f} -> {:.1f}'.format(
+                    result['size'], result['size'], result['start_channel'],
+                    result['mode'], result['packing'], metric, old_value, new_value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the DMX to LED pipeline on simulated hardware')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[17, 32, 48, 64])
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 100, 463])
+    parser.add_argument('--frames', type=int, default=500,
+                        help='frames sent for latency and allocations')
+    parser.add_argument('--duration', type=float, default=1,
+                        help='seconds spent measuring the output frame rate')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative regression against the baseline')
+    parser.add_argument('--network', nargs='*', default=[], choices=['native', 'ola'],
+                        help='also measure the latency of frames sent as E1.31 '
+                        'over UDP, through the native receiver and/or olad')
+    parser.add_argument('--packing', nargs='+', default=['rows'], choices=PACKINGS,
+                        help='how the pixels are spread over the universes, see '
+                        'routing.py')
+    parser.add_argument('--palette', action='store_true',
+                        help='also benchmark the panels in palette mode')
+    parser.add_argument('--effects', action='store_true',
+                        help='also measure the compute time of the effects')
+    parser.add_argument('--replay', help='also replay this DMX recording as fast as '
+                        'possible, see recording.py')
+    args = parser.parse_args()
+
+    results = []
+    modes = [False, True] if args.palette else [False]
+    for size, channel, palette, packing in itertools.product(
+            args.sizes, args.channels, modes, args.packing):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = benchmark_panel(size, channel, args.frames, args.duration,
+                                     palette, packing)
+        results.append(result)
+        print('{0}x{0} @{1} {8} {9} ({2} universes): callback p50 {3:.1f} us, '
+              'p99 {4:.1f} us, ingest {5:.0f} fps, output {6:.1f} fps, '
+              '{7:.0f} B/frame'.format(
+                  size, channel, result['universes'],
+                  result['callback_latency_us']['p50'],
+                  result['callback_latency_us']['p99'],
+                  result['ingest_fps'], result['output_fps'],
+                  result['allocated_bytes_per_frame']['mean'], result['mode'],
+                  packing))
+
+    network = []
+    for path in args.network:
+        if path == 'ola' and is_simulated('ola'):
+            print('Skipping the OLA network path: OLA is simulated, '
+                  'set LEDPANEL_SIMULATE=strip,gpio,lcd to use olad')
+            continue
+        for size in args.sizes:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                result = benchmark_network(size, path, args.frames)
+            network.append(result)
+            if result['frame_latency_us'] is None:
+                print('{0}x{0} {1}: no frame received'.format(size, path))
+                continue
+            print('{0}x{0} {1} ({2} universes): frame latency p50 {3:.1f} us, '
+                  'p99 {4:.1f} us, {5} lost'.format(
+                      size, path, result['universes'],
+                      result['frame_latency_us']['p50'],
+                      result['frame_latency_us']['p99'], result['lost_frames']))
+
+    replays = []
+    if args.replay:
+        for size in args.sizes:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                result = benchmark_replay(args.replay, size)
+            replays.append(result)
+            print('{0}x{0} replay: {1} records recorded over {2:.1f} s replayed in '
+                  '{3:.3f} s, {4:.0f} records/s, {5} frames shown'.format(
+                      size, result['records'], result['recorded_s'], result['replay_s'],
+                      result['records_per_s'], result['frames_shown']))
+
+    effect_results = []
+    if args.effects:
+        for cls in (effects.Plasma, effects.Gradient, effects.Noise, effects.Fire,
+                    effects.ScrollingText):
+            for size in args.sizes:
+                result = benchmark_effect(cls, size, args.frames)
+                effect_results.append(result)
+                print('{0}x{0} {1}: compute p50 {2:.1f} us, p99 {3:.1f} us, '
+                      'up to {4:.0f} fps{5}'.format(
+                          size, result['effect'], result['compute_us']['p50'],
+                          result['compute_us']['p99'], result['max_fps'],
+                          '' if result['max_fps'] >= 60 else ' (UNDER 60 FPS)'))
+
+    report = {
+        'machine': platform.machine(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+        'network': network,
+        'replay': replays,
+        'effects': effect_results,
+        }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
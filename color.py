@@ -0,0 +1,117 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+
+# Bytes holding red, green and blue in a little endian 0x00RRGGBB word
+_CHANNEL_BYTES = (2, 1, 0)
+
+
+class ColorCorrection:
+    """Gamma, white balance and master dimmer, applied on packed pixel words
+
+    gamma: Exponent applied to every channel, 1 is linear
+    balance: (red, green, blue) gains, between 0 and 1
+    dimmer: Master dimmer, between 0 and 255
+    dithering: Spreads the fractional part of the corrected values over
+               successive frames, the panel then needs to be refreshed
+               continuously.
+
+    The lookup tables are rebuilt on the first frame following a change.
+    """
+    def __init__(self, gamma=1, balance=(1, 1, 1), dimmer=255, dithering=False):
+        self._gamma = gamma
+        self._balance = tuple(balance)
+        self._dimmer = dimmer
+        self.dithering = dithering
+
+        self._luts = None
+        self._frame_count = 0
+        self._size = None
+
+    @property
+    def gamma(self):
+        return self._gamma
+
+    @gamma.setter
+    def gamma(self, value):
+        self._gamma = value
+        self._luts = None
+
+    @property
+    def balance(self):
+        return self._balance
+
+    @balance.setter
+    def balance(self, value):
+        self._balance = tuple(value)
+        self._luts = None
+
+    @property
+    def dimmer(self):
+        return self._dimmer
+
+    @dimmer.setter
+    def dimmer(self, value):
+        self._dimmer = value
+        self._luts = None
+
+    @property
+    def is_identity(self):
+        return (self._gamma == 1 and self._balance == (1, 1, 1)
+                and self._dimmer == 255 and not self.dithering)
+
+    def _buildLUTs(self):
+        levels = (np.arange(256) / 255) ** self._gamma * self._dimmer
+        values = np.outer(self._balance, levels).clip(0, 255)
+        # 8.8 fixed point for dithering, rounded 8 bits otherwise
+        return (np.round(values).astype(np.uint8),
+                np.round(values * 256).clip(0, 255 * 256).astype(np.uint16))
+
+    def _resize(self, size):
+        self._size = size
+        self._tmp8 = np.empty(size, dtype=np.uint8)
+        self._tmp16 = np.empty(size, dtype=np.uint16)
+        self._threshold = np.empty(size, dtype=np.uint16)
+        # Spread the dithering thresholds between neighbouring pixels
+        self._pattern = (np.arange(size) * 0.6180339887 % 1 * 256).astype(np.uint16)
+
+    def apply(self, words):
+        """Corrects `words`, an array of 0x00RRGGBB words, in place"""
+        luts = self._luts
+        if luts is None:
+            luts = self._luts = self._buildLUTs()
+        luts8, luts16 = luts
+
+        if len(words) != self._size:
+            self._resize(len(words))
+        pixels = words.view(np.uint8).reshape(-1, 4)
+
+        if self.dithering:
+            self._frame_count = (self._frame_count + 1) & 255
+            np.add(self._pattern, self._frame_count * 159, out=self._threshold)
+            self._threshold &= 255
+
+        for lut8, lut16, byte in zip(luts8, luts16, _CHANNEL_BYTES):
+            channel = pixels[:, byte]
+            if self.dithering:
+                np.take(lut16, channel, out=self._tmp16)
+                self._tmp16 += self._threshold
+                self._tmp16 >>= 8
+                channel[...] = self._tmp16
+            else:
+                np.take(lut8, channel, out=self._tmp8)
+                channel[...] = self._tmp8
@@ -0,0 +1,148 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import numpy as np
+
+MODES = ('crossfade', 'htp', 'multiply')
+
+
+class Layer:
+    """One source of pixels: the live DMX, a macro...
+
+    pixels: (count, 3) RGB array the source draws into, while holding the
+            compositor's lock
+    mode: How the layer is blended over the layers below it:
+          'crossfade' mixes it with them, 'htp' keeps the highest of both
+          values, 'multiply' darkens them
+    amount: How much of the layer is blended, between 0 and 1
+    mask: None, or a (count,) uint8 array, the alpha of each pixel
+
+    The layer is blended with amount * level, where the level is faded
+    with fadeTo(). It is used to show and hide the layer smoothly.
+    """
+    def __init__(self, name, count, mode='crossfade', amount=1, mask=None, level=1):
+        if mode not in MODES:
+            raise ValueError('mode must be one of {}'.format(', '.join(MODES)))
+
+        self.name = name
+        self.pixels = np.zeros((count, 3), dtype=np.uint8)
+        self.mode = mode
+        self.amount = amount
+        self.mask = mask
+
+        self._fade_from = self._fade_to = level
+        self._fade_start = 0
+        self._fade_time = 0
+
+    def fadeTo(self, level, duration=0):
+        """Fades the layer's level to `level` in `duration` ms"""
+        now = time.monotonic()
+        self._fade_from = self.level(now)
+        self._fade_to = level
+        self._fade_start = now
+        self._fade_time = duration / 1000
+
+    def level(self, now):
+        elapsed = now - self._fade_start
+        if elapsed >= self._fade_time:
+            return self._fade_to
+        return self._fade_from + (self._fade_to - self._fade_from) * (
+            elapsed / self._fade_time)
+
+    def fading(self, now):
+        return now - self._fade_start < self._fade_time
+
+    def alpha(self, now):
+        return self.amount * self.level(now)
+
+
+class Compositor:
+    """Blends layers, from the first added to the last, over black
+
+    Sources must hold `lock` while drawing into their layer.
+    """
+    def __init__(self, count):
+        self.count = count
+        self.layers = []
+        self.lock = threading.Lock()
+
+        self._result = np.zeros((count, 3), dtype=np.int32)
+        self._work = np.zeros((count, 3), dtype=np.int32)
+        self._weights = np.zeros((count, 1), dtype=np.int32)
+
+    def addLayer(self, name, **kwargs):
+        layer = Layer(name, self.count, **kwargs)
+        with self.lock:
+            self.layers.append(layer)
+        return layer
+
+    def removeLayer(self, layer):
+        with self.lock:
+            self.layers.remove(layer)
+
+    def animating(self, now=None):
+        """True while a layer is fading"""
+        now = time.monotonic() if now is None else now
+        return any(layer.fading(now) for layer in self.layers)
+
+    def compose(self, out, now=None):
+        """Blends the layers into `out`, a (count, 3) uint8 array
+
+        Must be called while holding `lock`.
+        """
+        now = time.monotonic() if now is None else now
+        result = self._result
+        work = self._work
+        result.fill(0)
+
+        for layer in self.layers:
+            # 8 bits fixed point alpha
+            alpha = np.int32(round(min(max(layer.alpha(now), 0), 1) * 256))
+            if alpha == 0:
+                continue
+
+            if layer.mask is not None:
+                weight = self._weights
+                np.multiply(layer.mask[:, np.newaxis], alpha, out=weight)
+                weight //= 255
+            elif alpha == 256 and layer.mode == 'crossfade':
+                np.copyto(result, layer.pixels)
+                continue
+            else:
+                weight = alpha
+
+            if layer.mode == 'crossfade':
+                np.subtract(layer.pixels, result, out=work)
+                work *= weight
+                work >>= 8
+                result += work
+            elif layer.mode == 'htp':
+                np.multiply(layer.pixels, weight, out=work)
+                work >>= 8
+                np.maximum(result, work, out=result)
+            else:
+                # multiply by the layer's pixels faded towards white
+                np.subtract(layer.pixels, np.int32(255), out=work)
+                work *= weight
+                work >>= 8
+                work += 255
+                result *= work
+                result //= 255
+
+        np.copyto(out, result, casting='unsafe')
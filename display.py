@@ -0,0 +1,118 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+
+class ShadowLCD(threading.Thread):
+    """Writes text to a character LCD from its own thread, sending only the
+    characters that changed
+
+    The thread keeps a copy of what is on the screen. Lines given to
+    write() are compared with it and only the changed cells are sent, at
+    most once every `refresh_interval` ms: lines written in between replace
+    the pending ones.
+
+    lcd: RPLCD CharLCD, or any object with the same interface, its size
+         being in lcd.lcd, an RPLCD LCDConfig
+    lock: Lock held while talking to the LCD, shared with the other users
+          of the bus
+    """
+    def __init__(self, lcd, lock=None, refresh_interval=50):
+        super(ShadowLCD, self).__init__(name='ShadowLCD', daemon=True)
+        self.lcd = lcd
+        self.lock = lock if lock is not None else threading.RLock()
+        self.period = refresh_interval / 1000
+
+        self._shown = None
+        self._pending = None
+        # Only held to swap _pending, so that write() never waits for the LCD
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = True
+
+        self.flush_count = 0
+
+    def write(self, *lines):
+        """Shows `lines`, one per row of the LCD. Never blocks."""
+        cols, rows = self.lcd.lcd.cols, self.lcd.lcd.rows
+        pending = [line[:cols].ljust(cols) for line in lines[:rows]]
+        with self._pending_lock:
+            self._pending = pending
+        self._wake.set()
+
+    def invalidate(self):
+        """Forgets what is on the screen, e.g. after clearing it, so that the
+        next flush rewrites every cell"""
+        self._shown = None
+
+    def stop(self):
+        """Shows the pending lines, then stops the thread"""
+        self._running = False
+        self._wake.set()
+        self.join()
+
+    def flush(self):
+        """Sends the pending lines to the LCD now"""
+        with self._pending_lock:
+            lines, self._pending = self._pending, None
+        if lines is None:
+            return
+
+        with self.lock:
+            if self._shown is None:
+                self.lcd.clear()
+                self._shown = [' ' * self.lcd.lcd.cols] * self.lcd.lcd.rows
+
+            for row, line in enumerate(lines):
+                for start, end in _changes(self._shown[row], line):
+                    self.lcd.cursor_pos = (row, start)
+                    self.lcd.write_string(line[start:end])
+                self._shown[row] = line
+        self.flush_count += 1
+
+    def run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            self.flush()
+            if not self._running:
+                self.flush()
+                break
+            time.sleep(self.period)
+
+
+def _changes(old, new):
+    """(start, end) of the runs of cells differing between `old` and `new`
+
+    Runs separated by a single unchanged cell are merged, rewriting it
+    costs as much as moving the cursor over it.
+    """
+    runs = []
+    start = end = None
+    for col, (old_char, new_char) in enumerate(zip(old, new)):
+        if old_char == new_char:
+            continue
+        if start is not None and col - end <= 1:
+            end = col + 1
+            continue
+        if start is not None:
+            runs.append((start, end))
+        start, end = col, col + 1
+    if start is not None:
+        runs.append((start, end))
+    return runs
@@ -0,0 +1,154 @@
+#!/bin/env python3
+
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+
+from backends import GPIO
+from LedPanel import ClientWrapper, LEDPanel, STATUS_LED, status_led
+from log import log
+from metrics import StatsWriter
+
+
+class SharedClient:
+    """Lets several panels listen to the same universes on one OLA client
+
+    Each universe is registered once with OLA, its data is handed to every
+    panel listening to it. Give each panel its own handle().
+    """
+    def __init__(self, client):
+        self._client = client
+        self.REGISTER = client.REGISTER
+        self.UNREGISTER = client.UNREGISTER
+        # universe -> {handle: data_callback}
+        self._listeners = {}
+
+    def handle(self):
+        return _ClientHandle(self)
+
+    def _register(self, universe, handle, data_callback):
+        listeners = self._listeners.get(universe)
+        if listeners is None:
+            listeners = self._listeners[universe] = {}
+            self._client.RegisterUniverse(universe, self.REGISTER,
+                                          self._getDispatcher(listeners))
+        listeners[handle] = data_callback
+
+    def _unregister(self, universe, handle):
+        listeners = self._listeners.get(universe)
+        if listeners is None:
+            return
+        listeners.pop(handle, None)
+        if not listeners:
+            del self._listeners[universe]
+            self._client.RegisterUniverse(universe, self.UNREGISTER, data_callback=None)
+
+    @staticmethod
+    def _getDispatcher(listeners):
+        def dispatch(data):
+            for data_callback in list(listeners.values()):
+                data_callback(data)
+        return dispatch
+
+
+class _ClientHandle:
+    """One panel's view of a SharedClient, same interface as the OLA client"""
+    def __init__(self, shared):
+        self._shared = shared
+        self.REGISTER = shared.REGISTER
+        self.UNREGISTER = shared.UNREGISTER
+
+    def RegisterUniverse(self, universe, action, data_callback=None, callback=None):
+        if action == self.REGISTER:
+            self._shared._register(universe, self, data_callback)
+        else:
+            self._shared._unregister(universe, self)
+        if callback is not None:
+            callback(None)
+
+
+class PanelDriver:
+    """Runs several panels in one process
+
+    The panels share one OLA client, whose callbacks only copy the DMX data
+    into each panel's layers. Each panel pushes its frames to its own strip
+    from its own output thread.
+    """
+    def __init__(self):
+        self._wrapper = ClientWrapper()
+        self._client = SharedClient(self._wrapper.Client())
+        self.panels = []
+
+    def addPanel(self, universe, channel, **kwargs):
+        """Creates a LEDPanel, see its documentation for the arguments"""
+        panel = LEDPanel(universe, channel, wrapper=self._wrapper,
+                         client=self._client.handle(), **kwargs)
+        self.panels.append(panel)
+        return panel
+
+    def threadSafeSchedule(self, time_in_ms, callback):
+        def f():
+            self._wrapper.AddEvent(time_in_ms, callback)
+        self._wrapper.Execute(f)
+
+    def run(self):
+        log.info("Launched {} panels", len(self.panels))
+        self._wrapper.Run()
+
+    def stop(self):
+        self._wrapper.Stop()
+        for panel in self.panels:
+            panel.stop()
+
+
+def parse_panel(spec):
+    """Parses UNIVERSE:CHANNEL:PIN[:STRIP_CHANNEL[:DMA]]"""
+    values = [int(value) for value in spec.split(':')]
+    if not 3 <= len(values) <= 5:
+        raise argparse.ArgumentTypeError(
+            'expected UNIVERSE:CHANNEL:PIN[:STRIP_CHANNEL[:DMA]], got {}'.format(spec))
+    return dict(zip(('universe', 'channel', 'pin', 'strip_channel', 'dma'), values))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Drives several LED panels')
+    parser.add_argument('panels', nargs='+', type=parse_panel,
+                        help='UNIVERSE:CHANNEL:PIN[:STRIP_CHANNEL[:DMA]], e.g. 0:1:12 '
+                        'for a panel on PWM0 and 2:1:21:0:11 for one on PCM. '
+                        'Pins 13 and 19, PWM1, are used by the buttons.')
+    parser.add_argument('--size', type=int, default=17)
+    args = parser.parse_args()
+
+    driver = PanelDriver()
+    for spec in args.panels:
+        driver.addPanel(size=args.size, **spec)
+
+    try:
+        GPIO.setmode(GPIO.BCM)
+
+        GPIO.setup(STATUS_LED, GPIO.OUT)
+        GPIO.output(STATUS_LED, GPIO.LOW)
+
+        for i, panel in enumerate(driver.panels):
+            StatsWriter(panel.metrics, '/tmp/ledpanel-stats-{}.json'.format(i)).start()
+        driver.run()
+    finally:
+        for panel in driver.panels:
+            panel.setOnOff(False)
+        driver.stop()
+        status_led.stop()
+        GPIO.cleanup()
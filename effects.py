@@ -0,0 +1,340 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+import time
+
+import numpy as np
+
+from macros import Macro
+from media import resize_table
+
+# Steps after which an effect over its budget is degraded, or one well
+# under it is restored
+OVER_BUDGET_STEPS = 3
+UNDER_BUDGET_STEPS = 120
+MAX_DIVISOR = 4
+MIN_FPS = 15
+
+# 3x5 font, each glyph being 5 rows of 3 bits, as octal digits
+FONT = {
+    '0': '75557', '1': '26227', '2': '71747', '3': '71717', '4': '55711',
+    '5': '74717', '6': '74757', '7': '71111', '8': '75757', '9': '75717',
+    'A': '25755', 'B': '65656', 'C': '34443', 'D': '65556', 'E': '74647',
+    'F': '74644', 'G': '34553', 'H': '55755', 'I': '72227', 'J': '11152',
+    'K': '55655', 'L': '44447', 'M': '57755', 'N': '65555', 'O': '25552',
+    'P': '65644', 'Q': '25563', 'R': '65655', 'S': '34216', 'T': '72222',
+    'U': '55557', 'V': '55552', 'W': '55775', 'X': '55255', 'Y': '55222',
+    'Z': '71247', ' ': '00000', '.': '00002', '!': '22202', '-': '00700',
+    ':': '02020', '?': '71202', "'": '22000',
+    }
+FONT_HEIGHT = 5
+
+
+def hsv_to_rgb(hue, value=1, out=None):
+    """Fully saturated colors of `hue` arrays, between 0 and 1, as a
+    (..., 3) float array"""
+    hue = np.mod(hue, 1) * 6
+    if out is None:
+        out = np.empty(hue.shape + (3,), dtype=np.float32)
+    out[..., 0] = np.abs(hue - 3) - 1
+    out[..., 1] = 2 - np.abs(hue - 2)
+    out[..., 2] = 2 - np.abs(hue - 4)
+    np.clip(out, 0, 1, out=out)
+    if not np.isscalar(value) or value != 1:
+        out *= np.asarray(value)[..., np.newaxis]
+    return out
+
+
+class Effect(Macro):
+    """A generated effect, drawn with array math
+
+    render(t) returns the frame at time `t` s, a (height, width, 3) float
+    array between 0 and 1, computed over `self.x` and `self.y`, the (height,
+    width) coordinates of the pixels' centers between 0 and 1. The frame is
+    then scaled to the panel.
+
+    If computing a frame takes more than `budget` of the frame period for a
+    few frames in a row, the effect is computed at a lower resolution, down
+    to a quarter of the panel's, then at a lower frame rate, down to
+    MIN_FPS. Both come back up when it is well under budget again.
+
+    The parameters, listed in PARAMETERS as name: (minimum, maximum), can
+    be driven from DMX with bindParameters().
+    """
+    PARAMETERS = {'speed': (0, 4)}
+    FRAME_PARAMETERS = ('target_fps', 'length')
+
+    def __init__(self, cols, rows, fps=60, budget=0.5, length=2 ** 31, **parameters):
+        super(Effect, self).__init__(cols, rows)
+        self.target_fps = self.fps = fps
+        self.budget = budget
+        self.length = length
+        self.divisor = 1
+        self.clock = 0
+        self.compute_time = 0
+        self.degradations = 0
+        self._over = self._under = 0
+
+        for name, value in parameters.items():
+            if name not in self.PARAMETERS:
+                raise TypeError('{} has no parameter {}'.format(
+                    type(self).__name__, name))
+            setattr(self, name, value)
+        self._setResolution(1)
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def step_length(self):
+        return 1000 / self.fps
+
+    def _setResolution(self, divisor):
+        self.divisor = divisor
+        self.width = max(1, -(-self.cols // divisor))
+        self.height = max(1, -(-self.rows // divisor))
+        self.x, self.y = np.meshgrid(
+            (np.arange(self.width, dtype=np.float32) + 0.5) / self.width,
+            (np.arange(self.height, dtype=np.float32) + 0.5) / self.height)
+        row_index, col_index = resize_table(self.width, self.height, self.cols, self.rows)
+        self._table = (row_index * self.width + col_index).reshape(-1)
+        self._small = np.zeros((self.height * self.width, 3), dtype=np.uint8)
+        self.resize()
+
+    def resize(self):
+        """Called when the resolution changes, to reset the effect's state"""
+        pass
+
+    def loop(self, i):
+        start = time.perf_counter()
+        rgb = self.render(self.clock)
+        np.multiply(rgb.reshape(-1, 3), 255, out=self._small, casting='unsafe')
+        np.take(self._small, self._table, axis=0, out=self.pixels, mode='clip')
+        self.clock += 1 / self.fps
+        self.compute_time = time.perf_counter() - start
+        self._checkBudget()
+
+    def _checkBudget(self):
+        budget = self.budget / self.fps
+        if self.compute_time > budget:
+            self._over += 1
+            self._under = 0
+            if self._over >= OVER_BUDGET_STEPS:
+                self._over = 0
+                self._degrade()
+        elif self.compute_time < budget / 4:
+            self._under += 1
+            self._over = 0
+            if self._under >= UNDER_BUDGET_STEPS:
+                self._under = 0
+                self._restore()
+        else:
+            self._over = self._under = 0
+
+    def _degrade(self):
+        if self.divisor < MAX_DIVISOR:
+            self._setResolution(self.divisor * 2)
+        elif self.fps > MIN_FPS:
+            self.fps = max(self.fps / 2, MIN_FPS)
+        else:
+            return
+        self.degradations += 1
+
+    def _restore(self):
+        if self.fps < self.target_fps:
+            self.fps = min(self.fps * 2, self.target_fps)
+        elif self.divisor > 1:
+            self._setResolution(self.divisor // 2)
+
+    def skip(self):
+        if not super(Effect, self).skip():
+            return False
+        self.clock += 1 / self.fps
+        return True
+
+    def reset(self):
+        super(Effect, self).reset()
+        self.clock = 0
+
+    @property
+    def parameters(self):
+        parameters = super(Effect, self).parameters
+        for name in self.PARAMETERS:
+            parameters[name] = getattr(self, name)
+        return parameters
+
+    def bindParameters(self, panel, universe, channel):
+        """Drives the parameters from DMX, one channel each in the order of
+        PARAMETERS starting at `channel`, 0 to 255 covering their range"""
+        for i, (name, (minimum, maximum)) in enumerate(self.PARAMETERS.items()):
+            panel.bindControl(universe, channel + i,
+                              self._getSetter(name, minimum, maximum))
+
+    def _getSetter(self, name, minimum, maximum):
+        def setter(value):
+            setattr(self, name, minimum + (maximum - minimum) * value / 255)
+        return setter
+
+
+class Plasma(Effect):
+    """Sum of sine waves, colored through the hues"""
+    PARAMETERS = {'speed': (0, 4), 'hue': (0, 1), 'scale': (0.25, 4)}
+    speed = 1
+    hue = 0
+    scale = 1
+
+    def render(self, t):
+        t *= self.speed
+        k = 10 * self.scale
+        x, y = self.x, self.y
+        value = np.sin(x * k + t)
+        value += np.sin((x * math.sin(t / 2) + y * math.cos(t / 3)) * k + t)
+        cx = x - 0.5 + 0.5 * math.sin(t / 5)
+        cy = y - 0.5 + 0.5 * math.cos(t / 3)
+        value += np.sin(np.sqrt(cx * cx + cy * cy) * k * 1.5 + t)
+        return hsv_to_rgb(value / 6 + self.hue)
+
+
+class Gradient(Effect):
+    """Rainbow rotating around the center of the panel"""
+    PARAMETERS = {'speed': (0, 4), 'hue': (0, 1), 'scale': (0.25, 4)}
+    speed = 0.5
+    hue = 0
+    scale = 1
+
+    def render(self, t):
+        angle = t * self.speed
+        position = (self.x - 0.5) * math.cos(angle) + (self.y - 0.5) * math.sin(angle)
+        return hsv_to_rgb(position * self.scale + self.hue)
+
+
+class Noise(Effect):
+    """Smooth value noise drifting over the panel"""
+    PARAMETERS = {'speed': (0, 4), 'hue': (0, 1), 'scale': (0.25, 4)}
+    FRAME_PARAMETERS = Effect.FRAME_PARAMETERS + ('seed',)
+    speed = 1
+    hue = 0
+    scale = 1
+
+    def __init__(self, cols, rows, seed=0, **kwargs):
+        self.seed = seed
+        self._rng = np.random.default_rng(seed)
+        self._lattice = None
+        super(Noise, self).__init__(cols, rows, **kwargs)
+
+    def render(self, t):
+        size = max(2, int(4 * self.scale))
+        if self._lattice is None or len(self._lattice) != size:
+            self._lattice = self._rng.random((size, size), dtype=np.float32)
+        lattice = self._lattice
+
+        u = self.x * size + t * self.speed
+        v = self.y * size + t * self.speed * 0.5
+        u0 = np.floor(u)
+        v0 = np.floor(v)
+        fu = u - u0
+        fv = v - v0
+        fu = fu * fu * (3 - 2 * fu)
+        fv = fv * fv * (3 - 2 * fv)
+        i0 = u0.astype(np.intp) % size
+        j0 = v0.astype(np.intp) % size
+        i1 = (i0 + 1) % size
+        j1 = (j0 + 1) % size
+        top = lattice[j0, i0] + (lattice[j0, i1] - lattice[j0, i0]) * fu
+        bottom = lattice[j1, i0] + (lattice[j1, i1] - lattice[j1, i0]) * fu
+        value = top + (bottom - top) * fv
+        return hsv_to_rgb(self.hue + value * 0.3, value)
+
+
+class Fire(Effect):
+    """Flames rising from the bottom of the panel"""
+    PARAMETERS = {'speed': (0, 4), 'scale': (0.25, 2)}
+    FRAME_PARAMETERS = Effect.FRAME_PARAMETERS + ('seed',)
+    speed = 1
+    scale = 1
+
+    def __init__(self, cols, rows, seed=0, **kwargs):
+        self.seed = seed
+        self._rng = np.random.default_rng(seed)
+        self._steps = 0
+        super(Fire, self).__init__(cols, rows, **kwargs)
+
+    def resize(self):
+        # two rows of sparks under the panel
+        self._heat = np.zeros((self.height + 2, self.width), dtype=np.float32)
+        self._rgb = np.zeros((self.height, self.width, 3), dtype=np.float32)
+
+    def render(self, t):
+        heat = self._heat
+        # taller flames cool down slower
+        decay = 1 - 1.5 / (self.height * self.scale + 1)
+        self._steps += self.speed * 60 / self.fps
+        while self._steps >= 1:
+            self._steps -= 1
+            heat[-2:] = self._rng.random((2, self.width), dtype=np.float32)
+            below = heat[1:-1]
+            heat[:-2] = (np.roll(below, 1, axis=1) + below + np.roll(below, -1, axis=1)
+                         + heat[2:]) * (decay / 4)
+
+        h = heat[:-2] * 3
+        rgb = self._rgb
+        rgb[..., 0] = h
+        rgb[..., 1] = h - 1
+        rgb[..., 2] = h - 2
+        return np.clip(rgb, 0, 1, out=rgb)
+
+
+class ScrollingText(Effect):
+    """Text scrolling from right to left, in a 3x5 font scaled to the panel
+
+    speed: in pixels per second
+    """
+    PARAMETERS = {'speed': (0, 60), 'hue': (0, 1)}
+    FRAME_PARAMETERS = Effect.FRAME_PARAMETERS + ('text',)
+    speed = 10
+    hue = 0
+
+    def __init__(self, cols, rows, text='LEDPANEL', **kwargs):
+        self.text = text
+        super(ScrollingText, self).__init__(cols, rows, **kwargs)
+
+    def resize(self):
+        # text as tall as the panel allows, centered
+        self._zoom = max(1, self.height // FONT_HEIGHT)
+        height = FONT_HEIGHT * self._zoom
+        top = (self.height - height) // 2
+
+        glyphs = [FONT.get(char, FONT['?']) for char in self.text.upper()]
+        # followed by a blank as wide as the panel
+        bitmap = np.zeros((FONT_HEIGHT, 4 * len(glyphs) + -(-self.width // self._zoom)),
+                          dtype=np.float32)
+        for n, glyph in enumerate(glyphs):
+            for row, bits in enumerate(glyph):
+                for col in range(3):
+                    if int(bits, 8) & (4 >> col):
+                        bitmap[row, n * 4 + col] = 1
+        rows = (np.arange(self.height) - top) // self._zoom
+        self._rows = np.clip(rows, 0, FONT_HEIGHT - 1)[:, np.newaxis]
+        self._visible = ((rows >= 0) & (rows < FONT_HEIGHT))[:, np.newaxis]
+        self._bitmap = bitmap
+        self._columns = np.arange(self.width)[np.newaxis, :]
+
+    def render(self, t):
+        offset = int(t * self.speed / self.divisor)
+        columns = (self._columns + offset) // self._zoom % self._bitmap.shape[1]
+        lit = self._bitmap[self._rows, columns] * self._visible
+        return hsv_to_rgb(np.full(lit.shape, self.hue, dtype=np.float32), lit)
@@ -0,0 +1,165 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from multiprocessing import shared_memory
+import os
+import struct
+
+import numpy as np
+
+# magic, version, columns, rows, slots
+BUS_HEADER = struct.Struct('<4sHHHH')
+BUS_MAGIC = b'LPFB'
+BUS_VERSION = 1
+SEQUENCE_OFFSET = 16
+# Identifies the resource tracker of the creator, 0 if unknown
+TRACKER = struct.Struct('<Q')
+TRACKER_OFFSET = 24
+FRAMES_OFFSET = 64
+
+
+class FrameBus:
+    """RGB frames shared between processes through shared memory
+
+    The memory holds a header, the sequence number of the last published
+    frame and `slots` frames of rows x columns RGB pixels. One process
+    writes: it draws into backBuffer() and calls publish(), or calls
+    write(). Any number of processes read the last published frame with
+    read(), or latest() to use it in place. No lock is taken: the writer
+    never touches the last published frame nor the one before it, and a
+    reader checks that the frame it copied was not overwritten meanwhile.
+
+    Create the bus with FrameBus.create() in one process, and attach to it
+    with FrameBus.attach() from the others.
+    """
+    def __init__(self, shm, owner=False):
+        self._shm = shm
+        self.owner = owner
+        magic, version, self.columns, self.rows, self.slots = BUS_HEADER.unpack_from(
+            shm.buf, 0)
+        if magic != BUS_MAGIC or version != BUS_VERSION:
+            raise ValueError('{} is not a frame bus'.format(shm.name))
+
+        self._sequence = np.ndarray((1,), dtype='<u8', buffer=shm.buf,
+                                    offset=SEQUENCE_OFFSET)
+        self.frames = np.ndarray((self.slots, self.rows, self.columns, 3),
+                                 dtype=np.uint8, buffer=shm.buf, offset=FRAMES_OFFSET)
+
+    @classmethod
+    def create(cls, name, columns, rows, slots=3):
+        """Creates the bus `name`, None for a random name, see `name`"""
+        if slots < 3:
+            raise ValueError('a frame bus needs at least 3 slots')
+        shm = shared_memory.SharedMemory(
+            name, create=True, size=FRAMES_OFFSET + slots * rows * columns * 3)
+        BUS_HEADER.pack_into(shm.buf, 0, BUS_MAGIC, BUS_VERSION, columns, rows, slots)
+        TRACKER.pack_into(shm.buf, TRACKER_OFFSET, _tracker_id())
+        struct.pack_into('<Q', shm.buf, SEQUENCE_OFFSET, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attaches to the bus `name`, from any process, including ones
+        forked from the creator"""
+        shm = shared_memory.SharedMemory(name)
+        # Only the creator must remove the memory, see bpo-39959. Processes
+        # started by the creator with multiprocessing share its resource
+        # tracker, in which the memory is registered once for all of them.
+        if _tracker_id() != TRACKER.unpack_from(shm.buf, TRACKER_OFFSET)[0]:
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, 'shared_memory')
+            except (ImportError, AttributeError):
+                pass
+        return cls(shm)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def sequence(self):
+        """Number of frames published so far"""
+        return int(self._sequence[0])
+
+    def backBuffer(self):
+        """Frame to draw into before calling publish()"""
+        return self.frames[(self.sequence + 1) % self.slots]
+
+    def publish(self):
+        self._sequence[0] += 1
+
+    def write(self, frame):
+        """Copies `frame`, any array of rows x columns RGB pixels, and
+        publishes it"""
+        back = self.backBuffer()
+        np.copyto(back, np.asarray(frame, dtype=np.uint8).reshape(back.shape))
+        self.publish()
+
+    def latest(self):
+        """(sequence, frame) of the last published frame, the frame being a
+        view into the shared memory. It is valid until valid() returns
+        False."""
+        sequence = self.sequence
+        return sequence, self.frames[sequence % self.slots]
+
+    def valid(self, sequence):
+        """True if the frame `sequence` has not been overwritten"""
+        return self.sequence - sequence < self.slots - 1
+
+    def read(self, out):
+        """Copies the last published frame into `out`, returns its sequence"""
+        while True:
+            sequence, frame = self.latest()
+            np.copyto(out.reshape(frame.shape), frame)
+            if self.valid(sequence):
+                return sequence
+
+    def close(self):
+        """Detaches from the bus, and removes it if this process created it"""
+        self.frames = self._sequence = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+
+def _tracker_id():
+    """Inode of the pipe to this process' resource tracker, the same in the
+    processes sharing it, 0 if there is none"""
+    try:
+        from multiprocessing import resource_tracker
+        return os.fstat(resource_tracker._resource_tracker._fd).st_ino
+    except (ImportError, AttributeError, TypeError, OSError):
+        return 0
+
+
+class FrameBusSource:
+    """Copies the frames published on a bus into a layer, see
+    OutputThread.addSource()"""
+    def __init__(self, bus, layer):
+        if bus.columns * bus.rows != len(layer.pixels):
+            raise ValueError('the bus is {}x{}, for {} pixels'.format(
+                bus.columns, bus.rows, len(layer.pixels)))
+        self.bus = bus
+        self.layer = layer
+        self._sequence = 0
+
+    def poll(self):
+        """Copies the last frame if it is new, returns True if it was"""
+        if self.bus.sequence == self._sequence:
+            return False
+        self._sequence = self.bus.read(self.layer.pixels)
+        return True
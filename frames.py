@@ -0,0 +1,95 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+class FrameAssembler:
+    """Collects the universes of a frame to show them all at once
+
+    A frame is complete when every universe has been received, or when
+    sync() is called. If some universes are still missing `hold_time` ms
+    after the first one came in, the frame is shown anyway and counted as
+    partial. Receiving a universe twice also closes the current frame:
+    begin() closes it before the new data of the universe is written.
+
+    show: called with no arguments to push a frame to the LEDs
+    schedule: schedule(time_in_ms, callback), runs callback on the same
+              thread as received()
+    """
+    def __init__(self, universes, show, schedule, hold_time=10):
+        self._show = show
+        self._schedule = schedule
+        self.hold_time = hold_time
+
+        self.complete_frames = 0
+        self.partial_frames = 0
+        self.unchanged_frames = 0
+
+        self._received = set()
+        self._changed = False
+        self._generation = 0
+        self._timer_armed = False
+
+        self.setUniverses(universes)
+
+    def setUniverses(self, universes):
+        self.universes = frozenset(universes)
+        self._received.clear()
+        self._changed = False
+        self._generation += 1
+        self._timer_armed = False
+
+    def begin(self, universe):
+        """Shows the current frame if it already has `universe`, to call
+        before writing the new data of `universe`"""
+        if universe in self._received:
+            self._flush()
+
+    def received(self, universe, changed=True):
+        """Signals that `universe` was received, `changed` if its data changed"""
+        self.begin(universe)
+
+        self._received.add(universe)
+        self._changed = self._changed or changed
+
+        if self._received >= self.universes:
+            self._flush()
+        elif not self._timer_armed:
+            self._timer_armed = True
+            generation = self._generation
+            self._schedule(self.hold_time, lambda: self._holdExpired(generation))
+
+    def sync(self):
+        """Shows the frame being assembled right now"""
+        self._flush()
+
+    def _holdExpired(self, generation):
+        if generation == self._generation:
+            self._flush()
+
+    def _flush(self):
+        if self._changed:
+            self._show()
+            if self._received >= self.universes:
+                self.complete_frames += 1
+            else:
+                self.partial_frames += 1
+        elif self._received:
+            self.unchanged_frames += 1
+
+        self._received.clear()
+        self._changed = False
+        self._generation += 1
+        self._timer_armed = False
@@ -0,0 +1,72 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from dataclasses import dataclass
+
+import numpy as np
+
+ORIGINS = ('top-left', 'top-right', 'bottom-left', 'bottom-right')
+
+
+@dataclass(frozen=True)
+class Layout:
+    """How the LEDs of a panel are wired
+
+    origin: Corner of the panel where the strip starts, one of ORIGINS
+    vertical: The strip runs along the columns instead of the rows
+    serpentine: Every other row (or column) runs in the opposite direction
+    rotation: Clockwise rotation of the image on the panel, in degrees,
+              a multiple of 90
+    flip: Mirror the image horizontally, before rotating it
+
+    The image itself is always received row by row, from the top left.
+    """
+    origin: str = 'top-left'
+    vertical: bool = False
+    serpentine: bool = False
+    rotation: int = 0
+    flip: bool = False
+
+    def __post_init__(self):
+        if self.origin not in ORIGINS:
+            raise ValueError('origin must be one of {}'.format(', '.join(ORIGINS)))
+        if self.rotation % 90 != 0:
+            raise ValueError('rotation must be a multiple of 90')
+
+    def compile(self, columns, rows):
+        """Returns the index table of a `columns`x`rows` image
+
+        The table holds, for each LED of the strip, the index of its pixel
+        in the image, so that strip_frame = image_frame[table].
+        """
+        # pixel index shown at each position of the panel, seen from the front
+        panel = np.arange(columns * rows, dtype=np.intp).reshape(rows, columns)
+        if self.flip:
+            panel = panel[:, ::-1]
+        panel = np.rot90(panel, -(self.rotation // 90) % 4)
+
+        if self.origin.startswith('bottom'):
+            panel = panel[::-1]
+        if self.origin.endswith('right'):
+            panel = panel[:, ::-1]
+        if self.vertical:
+            panel = panel.T
+
+        panel = panel.copy()
+        if self.serpentine:
+            panel[1::2] = panel[1::2, ::-1]
+
+        return panel.reshape(-1)
@@ -0,0 +1,130 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Leveled log, written to stdout by a background thread.
+#
+# LEDPANEL_LOG_LEVEL sets the lowest level written: debug, info, warning or
+# error, info by default. e.g. LEDPANEL_LOG_LEVEL=debug python3 LedPanel.py
+
+import atexit
+import collections
+import os
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+LEVEL_NAMES = {level: name.upper() for name, level in LEVELS.items()}
+
+
+class Log(threading.Thread):
+    """Leveled log whose messages are formatted and written by its own thread
+
+    Logging a message only appends it, with its arguments, to a ring buffer
+    of `capacity` entries. The thread empties it every `interval` seconds,
+    or right away for warnings and errors. When the buffer is full, the
+    oldest messages are dropped and counted in `dropped`.
+
+    Messages are str.format() strings. Messages logged with sample=n are
+    only kept once every n times, e.g. for one per DMX packet.
+    The thread is started by the first message kept.
+    """
+    def __init__(self, level=INFO, stream=None, capacity=1024, interval=0.2):
+        super(Log, self).__init__(name='Log', daemon=True)
+        self.level = level
+        self.stream = stream
+        self.interval = interval
+
+        self._buffer = collections.deque(maxlen=capacity)
+        self._samples = {}
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._launched = False
+
+        self.dropped = 0
+
+    def log(self, level, message, *args, sample=1):
+        if level < self.level:
+            return
+        if sample > 1:
+            count = self._samples.get(message, 0)
+            self._samples[message] = count + 1
+            if count % sample:
+                return
+
+        buffer = self._buffer
+        if len(buffer) == buffer.maxlen:
+            self.dropped += 1
+        buffer.append((time.time(), level, message, args))
+
+        if not self._launched:
+            self._startOnce()
+        if level >= WARNING:
+            self._wake.set()
+
+    def debug(self, message, *args, sample=1):
+        self.log(DEBUG, message, *args, sample=sample)
+
+    def info(self, message, *args, sample=1):
+        self.log(INFO, message, *args, sample=sample)
+
+    def warning(self, message, *args, sample=1):
+        self.log(WARNING, message, *args, sample=sample)
+
+    def error(self, message, *args, sample=1):
+        self.log(ERROR, message, *args, sample=sample)
+
+    def _startOnce(self):
+        with self._start_lock:
+            if self._launched:
+                return
+            self._launched = True
+            atexit.register(self.flush)
+            self.start()
+
+    def flush(self):
+        """Writes the buffered messages now"""
+        lines = []
+        while True:
+            try:
+                when, level, message, args = self._buffer.popleft()
+            except IndexError:
+                break
+            stamp = time.strftime('%H:%M:%S', time.localtime(when))
+            lines.append('{}.{:03d} {} {}\n'.format(
+                stamp, int(when * 1000) % 1000, LEVEL_NAMES[level],
+                message.format(*args) if args else message))
+        if not lines:
+            return
+
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write(''.join(lines))
+        stream.flush()
+
+    def run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+
+log = Log(LEVELS.get(os.environ.get('LEDPANEL_LOG_LEVEL', 'info').lower(), INFO))
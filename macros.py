@@ -15,6 +15,20 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from dataclasses import dataclass, astuple
+import hashlib
+import os
+import struct
+
+import numpy as np
+
+from log import log
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'ledpanel')
+
+# magic, version, cols, rows, step count
+CACHE_HEADER = struct.Struct('<4sHHHI')
+CACHE_MAGIC = b'LPMC'
+CACHE_VERSION = 1
 
 
 @dataclass()
@@ -36,12 +50,29 @@ class Color:
 
 
 class Macro:
-    """Base Macro class"""
+    """Base Macro class
+
+    loop(i) draws the i-th step of the macro into `self.frame`, a (rows,
+    cols, 3) RGB array reused for every step, and returns None. Iterating
+    over the macro yields that same array after each step.
+
+    loop(i) can also return a new panel, as a list of rows of Color or of
+    [r, g, b] lists, which is then copied into `self.frame`.
+
+    FRAME_PARAMETERS lists the attributes the frames depend on, besides
+    the panel size, to key the frames cache.
+    """
+    FRAME_PARAMETERS = ()
+
     def __init__(self, cols, rows):
         self.cols = cols
         self.rows = rows
         self.index = 0
 
+        self.frame = np.zeros((rows, cols, 3), dtype=np.uint8)
+        # Same buffer, one pixel per row
+        self.pixels = self.frame.reshape(-1, 3)
+
     @property
     def empty_color_panel(self):
         return [[Color() for _ in range(self.cols)] for _ in range(self.rows)]
@@ -72,15 +103,33 @@ class Macro:
             self.index = 0
             raise StopIteration
 
-        val = self.decode(self.loop(self.index))
+        panel = self.loop(self.index)
+        if panel is not None:
+            self.pixels[...] = self.decode(panel)
 
         self.index += 1
 
-        return val
+        return self.frame
 
     def reset(self):
         self.index = 0
 
+    def skip(self):
+        """Advances one step without drawing it, False at the end"""
+        if self.index == len(self):
+            return False
+        self.index += 1
+        return True
+
+    @property
+    def parameters(self):
+        """What the frames depend on: the panel size and FRAME_PARAMETERS.
+        Used to key the frames cache."""
+        parameters = {'cols': self.cols, 'rows': self.rows}
+        for name in self.FRAME_PARAMETERS:
+            parameters[name] = getattr(self, name)
+        return parameters
+
 
 class TestPixels(Macro):
     """An example macro"""
@@ -91,23 +140,15 @@ class TestPixels(Macro):
         i -= 1
 
         if i == -1:
-            panel = self.empty_color_panel
-
-            for row in panel:
-                for pixel in row:
-                    pixel.white = 255
-
-            return panel
+            self.frame.fill(255)
         else:
-            panel = self.empty_table_panel
+            self.frame.fill(0)
 
             color = i % 3
             col = (i // 3) % self.cols
             row = ((i // 3) // self.cols) % self.rows
 
-            panel[row][col][color] = 255
-
-        return panel
+            self.frame[row, col, color] = 255
 
     def __len__(self):
         return self.cols * self.rows * 3 + 1
@@ -121,3 +162,120 @@ class TestPixels(Macro):
             return 10*1000
         else:
             return 250
+
+
+def cache_path(macro, cache_dir=CACHE_DIR):
+    """Path of the frames cache of `macro`, unique to its parameters"""
+    cls = type(macro)
+    key = repr((cls.__module__, cls.__qualname__, sorted(macro.parameters.items())))
+    return os.path.join(cache_dir, '{}-{}x{}-{}.lpmc'.format(
+        cls.__name__, macro.cols, macro.rows,
+        hashlib.sha1(key.encode()).hexdigest()[:16]))
+
+
+def render_cache(macro, path):
+    """Renders every step of `macro` into the cache file at `path`
+
+    The file holds the header, every frame, then the step length before
+    each step and the one after the last step, as uint32 ms.
+    """
+    macro.reset()
+    durations = [macro.step_length]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, macro.cols, macro.rows,
+                                  len(macro)))
+        for frame in macro:
+            f.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+            durations.append(macro.step_length)
+        f.write(np.array(durations[:len(macro) + 1], dtype='<u4').tobytes())
+    os.replace(tmp_path, path)
+
+
+def open_cache(path, cols, rows):
+    """Maps the cache file at `path`, returns (frames, durations)
+
+    Raises ValueError if the file was not made for a `cols`x`rows` panel.
+    """
+    with open(path, 'rb') as f:
+        magic, version, file_cols, file_rows, count = CACHE_HEADER.unpack(
+            f.read(CACHE_HEADER.size))
+    if magic != CACHE_MAGIC or version != CACHE_VERSION:
+        raise ValueError('{} is not a macro cache'.format(path))
+    if (file_cols, file_rows) != (cols, rows):
+        raise ValueError('{} was made for a {}x{} panel'.format(path, file_cols,
+                                                                file_rows))
+
+    frames = np.memmap(path, dtype=np.uint8, mode='r', offset=CACHE_HEADER.size,
+                       shape=(count, rows, cols, 3))
+    durations = np.memmap(path, dtype='<u4', mode='r',
+                          offset=CACHE_HEADER.size + frames.nbytes, shape=(count + 1,))
+    return frames, durations
+
+
+class CachedMacro(Macro):
+    """Plays a deterministic macro from a pre-rendered cache file
+
+    The cache is rendered the first time the macro runs, then memory mapped:
+    each step is a view into the file. The cache is keyed by the macro's
+    parameters and the panel size, a change in either renders a new one.
+    If the cache can't be written, the macro is played directly.
+    """
+    def __init__(self, macro, cache_dir=CACHE_DIR):
+        super(CachedMacro, self).__init__(macro.cols, macro.rows)
+        self.macro = macro
+        self.path = cache_path(macro, cache_dir)
+        self._frames = None
+        self._durations = None
+
+    def _open(self):
+        try:
+            self._frames, self._durations = open_cache(self.path, self.cols, self.rows)
+        except (OSError, ValueError):
+            try:
+                render_cache(self.macro, self.path)
+                self._frames, self._durations = open_cache(self.path, self.cols,
+                                                           self.rows)
+            except OSError as e:
+                log.error("Could not cache macro in {}: {}", self.path, e)
+                self._frames = False
+
+    def loop(self, i):
+        if self._frames is None:
+            self._open()
+        if self._frames is False:
+            self.macro.index = i
+            self.frame[...] = next(self.macro)
+        else:
+            self.frame[...] = self._frames[i]
+
+    def __next__(self):
+        if self._frames is None:
+            self._open()
+        if self._frames is False:
+            self.macro.index = self.index
+            try:
+                return next(self.macro)
+            finally:
+                self.index = self.macro.index
+
+        if self.index == len(self):
+            self.index = 0
+            raise StopIteration
+
+        frame = self._frames[self.index]
+        self.index += 1
+        return frame
+
+    def __len__(self):
+        return len(self.macro)
+
+    @property
+    def step_length(self):
+        """Length of a step in ms"""
+        if self._durations is None or self._frames is False:
+            self.macro.index = self.index
+            return self.macro.step_length
+        return int(self._durations[self.index])
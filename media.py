@@ -0,0 +1,227 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import glob
+import os
+import queue
+import threading
+
+import numpy as np
+
+from log import log
+from macros import Macro
+
+try:
+    from PIL import Image, ImageSequence
+except ImportError:  # Pillow is only needed to play images
+    Image = ImageSequence = None
+
+# Frames decoded ahead of the one shown
+PREFETCH = 8
+
+
+def resize_table(width, height, cols, rows):
+    """Index tables (row_index, col_index) resizing a height x width image to
+    rows x cols, nearest neighbour: small = image[row_index, col_index]"""
+    row_index = (np.arange(rows) * height // rows)[:, np.newaxis]
+    col_index = (np.arange(cols) * width // cols)[np.newaxis, :]
+    return row_index, col_index
+
+
+def raw_frames(path, width, height, cols, rows, fps=25):
+    """Yields (frame, ms) from a file of raw width x height RGB24 frames,
+    e.g. made with ffmpeg -f rawvideo -pix_fmt rgb24"""
+    row_index, col_index = resize_table(width, height, cols, rows)
+    buffer = np.empty((height, width, 3), dtype=np.uint8)
+    with open(path, 'rb') as f:
+        while f.readinto(buffer) == buffer.nbytes:
+            yield buffer[row_index, col_index], 1000 / fps
+
+
+def raw_frame_count(path, width, height):
+    return os.path.getsize(path) // (width * height * 3)
+
+
+def _image_paths(path):
+    if isinstance(path, (list, tuple)):
+        return list(path)
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, name) for name in os.listdir(path))
+    if glob.has_magic(path):
+        return sorted(glob.glob(path))
+    return [path]
+
+
+def image_frames(path, cols, rows, fps=25):
+    """Yields (frame, ms) from an image, an animated GIF, a directory of
+    images or a glob pattern, played in name order
+
+    GIF frames keep their own duration, the others last 1/fps s.
+    """
+    if Image is None:
+        raise RuntimeError('Pillow is needed to play images')
+    for image_path in _image_paths(path):
+        with Image.open(image_path) as image:
+            for frame in ImageSequence.Iterator(image):
+                duration = frame.info.get('duration') or 1000 / fps
+                small = frame.convert('RGB').resize((cols, rows), Image.BILINEAR)
+                yield np.asarray(small, dtype=np.uint8), duration
+
+
+def image_frame_count(path):
+    if Image is None:
+        raise RuntimeError('Pillow is needed to play images')
+    count = 0
+    for image_path in _image_paths(path):
+        with Image.open(image_path) as image:
+            count += getattr(image, 'n_frames', 1)
+    return count
+
+
+class _Prefetcher(threading.Thread):
+    """Runs a frames generator, queuing its frames, None once it is over"""
+    def __init__(self, frames, size):
+        super(_Prefetcher, self).__init__(name='Prefetcher', daemon=True)
+        self.frames = frames
+        self.queue = queue.Queue(maxsize=size)
+        self._stop_event = threading.Event()
+
+    def _put(self, item):
+        while not self._stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self):
+        try:
+            for frame, duration in self.frames():
+                if not self._put((frame, duration)):
+                    return
+        except Exception as e:
+            log.error("Could not decode frames: {}", e)
+        self._put(None)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class StreamMacro(Macro):
+    """Plays frames streamed by a generator
+
+    frames: function returning a generator of (frame, ms), each frame being
+            a (rows, cols, 3) RGB array shown for ms milliseconds, see
+            raw_frames() and image_frames()
+    length: Number of frames
+
+    The frames are decoded by a thread, up to `prefetch` frames ahead, so
+    only that many are in memory whatever the length of the clip. Iterating
+    waits for the next frame to be decoded, while a MacroPlayer checks
+    ready() and shows the current frame for another step instead of
+    waiting for it.
+    """
+    def __init__(self, cols, rows, frames, length, prefetch=PREFETCH):
+        super(StreamMacro, self).__init__(cols, rows)
+        self._frames = frames
+        self._length = length
+        self.prefetch = prefetch
+        self._prefetcher = None
+        self._duration = 0
+
+    def __len__(self):
+        return self._length
+
+    def __next__(self):
+        if self.index == len(self):
+            self.reset()
+            raise StopIteration
+
+        if self._prefetcher is None:
+            self._prefetcher = _Prefetcher(self._frames, self.prefetch)
+            self._prefetcher.start()
+
+        item = self._prefetcher.queue.get()
+        if item is None:
+            self.reset()
+            raise StopIteration
+
+        frame, self._duration = item
+        np.copyto(self.frame, frame)
+        self.index += 1
+        return self.frame
+
+    def ready(self):
+        """Whether the next step can be taken without waiting for a frame"""
+        return self._prefetcher is None or self.index == len(self) \
+            or not self._prefetcher.queue.empty()
+
+    def skip(self):
+        """Drops the next frame if it is decoded already"""
+        if self._prefetcher is None or self.index == len(self):
+            return False
+        try:
+            item = self._prefetcher.queue.get_nowait()
+        except queue.Empty:
+            return False
+        if item is None:
+            # Over, the next step raises StopIteration
+            self.index = len(self)
+            return False
+        _, self._duration = item
+        self.index += 1
+        return True
+
+    def reset(self):
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+            self._prefetcher = None
+        self.index = 0
+        self._duration = 0
+
+    @property
+    def step_length(self):
+        """How long the current frame lasts, in ms"""
+        return self._duration
+
+
+class RawVideo(StreamMacro):
+    """Plays a file of raw width x height RGB24 frames at `fps`"""
+    FRAME_PARAMETERS = ('path', 'width', 'height', 'fps')
+
+    def __init__(self, cols, rows, path, width, height, fps=25, prefetch=PREFETCH):
+        super(RawVideo, self).__init__(
+            cols, rows, lambda: raw_frames(path, width, height, cols, rows, fps),
+            raw_frame_count(path, width, height), prefetch)
+        self.path = path
+        self.width = width
+        self.height = height
+        self.fps = fps
+
+
+class ImageAnimation(StreamMacro):
+    """Plays an image, an animated GIF, a directory of images or a glob
+    pattern, see image_frames(). Needs Pillow."""
+    FRAME_PARAMETERS = ('path', 'fps')
+
+    def __init__(self, cols, rows, path, fps=25, prefetch=PREFETCH):
+        super(ImageAnimation, self).__init__(
+            cols, rows, lambda: image_frames(path, cols, rows, fps),
+            image_frame_count(path), prefetch)
+        self.path = path
+        self.fps = fps
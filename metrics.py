@@ -0,0 +1,125 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import threading
+import time
+
+from log import log
+
+STATS_FILE = '/tmp/ledpanel-stats.json'
+
+# Bucket i holds the durations d with 2**(i-1) <= d < 2**i us, the last one
+# everything above
+BUCKET_COUNT = 24
+
+
+class Histogram:
+    """Durations histogram with power of two buckets, in us"""
+    def __init__(self):
+        self.buckets = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, duration_ns):
+        us = duration_ns // 1000
+        self.buckets[min(us.bit_length(), BUCKET_COUNT - 1)] += 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of the values"""
+        threshold = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= threshold:
+                return min(2 ** i, self.max)
+        return 0
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_us': self.total / self.count if self.count else 0,
+            'p50_us': self.percentile(0.5),
+            'p99_us': self.percentile(0.99),
+            'max_us': self.max,
+            'buckets': list(self.buckets),
+            }
+
+
+class Metrics:
+    """Timing histograms and counters of the pipeline
+
+    Histograms and counters are created on first use. Values already
+    counted elsewhere can be exposed with watch() instead.
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._watched = {}
+
+    def record(self, name, duration_ns):
+        try:
+            histogram = self.histograms[name]
+        except KeyError:
+            histogram = self.histograms[name] = Histogram()
+        histogram.record(duration_ns)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def watch(self, name, getter):
+        """Reports getter() as the `name` counter"""
+        self._watched[name] = getter
+
+    def snapshot(self):
+        counters = dict(self.counters)
+        for name, getter in self._watched.items():
+            counters[name] = getter()
+        return {
+            'time': time.time(),
+            'counters': counters,
+            'histograms': {name: histogram.snapshot()
+                           for name, histogram in list(self.histograms.items())},
+            }
+
+
+class StatsWriter(threading.Thread):
+    """Writes the metrics snapshot to a JSON file every `interval` seconds"""
+    def __init__(self, metrics, path=STATS_FILE, interval=5):
+        super(StatsWriter, self).__init__(name='StatsWriter', daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+
+    def write(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.metrics.snapshot(), f)
+        os.replace(tmp_path, self.path)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except OSError as e:
+                log.error("Could not write stats to {}: {}", self.path, e)
@@ -0,0 +1,155 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import numpy as np
+
+from pixels import PixelPacker, StripWriter
+
+
+class OutputThread(threading.Thread):
+    """Pushes frames to the strip from its own thread
+
+    Producers draw into the layers of `compositor` and call publish() once
+    their frame is ready. The thread blends the layers into the back buffer
+    and copies it into the strip's own LED buffer, the front one, before
+    showing it, at most `fps` times per second. Frames published while one
+    is waiting to be shown replace it and are counted as dropped.
+
+    Sources added with addSource() are polled every frame period, see
+    framebus.FrameBusSource. If `preview` is a framebus.FrameBus, every
+    frame shown is also published on it, before the layout and the
+    correction.
+
+    `layout` is an index table from Layout.compile(), applied to the back
+    buffer when copying it to the strip. None means the strip order is the
+    image order. `correction` is a color.ColorCorrection applied to every
+    frame on its way to the strip. Render and show() times are recorded in
+    `metrics` if given.
+
+    Only this thread may call the strip's show() once it is started.
+    """
+    def __init__(self, strip, compositor, fps=60, layout=None, correction=None,
+                 metrics=None):
+        super(OutputThread, self).__init__(name='OutputThread', daemon=True)
+        self._strip = strip
+        self._writer = StripWriter(strip)
+        self.compositor = compositor
+        self.period = 1 / fps
+
+        self._rgb = np.zeros((strip.numPixels(), 3), dtype=np.uint8)
+        self._packer = PixelPacker(strip.numPixels())
+
+        if layout is not None and np.array_equal(layout, np.arange(len(layout))):
+            layout = None
+        self._layout = layout
+        self._front = np.zeros(strip.numPixels(), dtype='<u4')
+        self.correction = correction
+        self.metrics = metrics
+        self.preview = None
+        self._sources = []
+
+        self._wake = threading.Event()
+        self._dirty = False
+        self._running = True
+
+        self.shown_frames = 0
+        self.dropped_frames = 0
+
+    def publish(self):
+        """Marks the layers as holding a new frame to show. Never blocks."""
+        if self._dirty:
+            self.dropped_frames += 1
+        self._dirty = True
+        self._wake.set()
+
+    def addSource(self, source):
+        """Polls `source` every frame period: source.poll() is called while
+        holding the compositor's lock, and returns True if it drew a new
+        frame into its layer"""
+        self._sources.append(source)
+        self._wake.set()
+
+    def removeSource(self, source):
+        self._sources.remove(source)
+
+    def _pollSources(self):
+        with self.compositor.lock:
+            polled = [source.poll() for source in self._sources]
+        return any(polled)
+
+    def stop(self):
+        """Shows the last published frame if needed, then stops the thread"""
+        self._running = False
+        self._wake.set()
+        self.join()
+
+    def _needsRefresh(self):
+        """True if frames must be shown even if none is published"""
+        # Dithering and fades change the output from one frame to the next
+        return ((self.correction is not None and self.correction.dithering)
+                or self.compositor.animating())
+
+    def _render(self):
+        correction = self.correction
+        if correction is not None and correction.is_identity:
+            correction = None
+
+        with self.compositor.lock:
+            self._dirty = False
+            self.compositor.compose(self._rgb)
+        if self.preview is not None:
+            self.preview.write(self._rgb)
+
+        words = self._packer.pack(self._rgb.reshape(-1))
+        if self._layout is not None:
+            np.take(words, self._layout, out=self._front)
+            words = self._front
+        if correction is not None:
+            correction.apply(words)
+        self._writer.write(0, words)
+
+    def run(self):
+        next_show = time.monotonic()
+        while True:
+            refresh = self._needsRefresh()
+            polling = bool(self._sources)
+            self._wake.wait(self.period if refresh or polling else None)
+            self._wake.clear()
+            if polling and self._pollSources():
+                self._dirty = True
+
+            if self._dirty or refresh:
+                delay = next_show - time.monotonic()
+                if delay > 0 and self._running:
+                    time.sleep(delay)
+
+                start = time.perf_counter_ns()
+                self._render()
+                rendered = time.perf_counter_ns()
+
+                next_show = time.monotonic() + self.period
+                self._strip.show()
+                self.shown_frames += 1
+
+                if self.metrics is not None:
+                    self.metrics.record('render', rendered - start)
+                    self.metrics.record('show', time.perf_counter_ns() - rendered)
+
+            if not self._running:
+                break
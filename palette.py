@@ -0,0 +1,64 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+
+PALETTE_SIZE = 256
+
+
+def rgb332():
+    """3 bits of red, 3 of green and 2 of blue per index"""
+    index = np.arange(PALETTE_SIZE)
+    colors = np.empty((PALETTE_SIZE, 3), dtype=np.uint8)
+    colors[:, 0] = (index >> 5) * 255 // 7
+    colors[:, 1] = ((index >> 2) & 7) * 255 // 7
+    colors[:, 2] = (index & 3) * 255 // 3
+    return colors
+
+
+class Palette:
+    """256 colors, the pixels of a panel in palette mode being indices into it
+
+    colors: (256, 3) RGB array, the 3-3-2 palette by default
+    """
+    def __init__(self, colors=None):
+        self.colors = rgb332()
+        if colors is not None:
+            self.setColors(0, colors)
+
+    @classmethod
+    def fromFile(cls, path):
+        """Loads a raw palette file, RGB bytes one color after the other, such
+        as an Adobe .act color table"""
+        return cls(np.fromfile(path, dtype=np.uint8))
+
+    def setColors(self, first, channels):
+        """Sets the colors from index `first` on from `channels`, RGB values
+        one color after the other. Returns True if a color changed."""
+        channels = np.asarray(channels, dtype=np.uint8).reshape(-1)
+        count = min(channels.size // 3, PALETTE_SIZE - first)
+        if count <= 0:
+            return False
+        colors = channels[:count * 3].reshape(count, 3)
+        if np.array_equal(self.colors[first:first + count], colors):
+            return False
+        self.colors[first:first + count] = colors
+        return True
+
+    def expand(self, indices, out):
+        """Writes the colors of `indices` into `out`, a (len(indices), 3) array"""
+        # indices can't be out of range, 'clip' spares a temporary copy of out
+        np.take(self.colors, indices, axis=0, out=out, mode='clip')
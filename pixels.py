@@ -0,0 +1,85 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import ctypes
+
+import numpy as np
+
+
+class PixelPacker:
+    """Packs RGB channels into 0x00RRGGBB pixel words
+
+    The words buffer is allocated once and reused for every frame.
+    """
+    def __init__(self, count):
+        self.count = count
+        self.words = np.zeros(count, dtype='<u4')
+        # Byte view of the words: little endian, so [blue, green, red, white]
+        self._bytes = self.words.view(np.uint8).reshape(count, 4)
+
+    def pack(self, channels):
+        """Packs `channels` (any uint8 sequence) and returns the words
+
+        Missing channels at the end of `channels` are considered to be 0.
+        """
+        channels = np.asarray(channels, dtype=np.uint8)
+        used = min(channels.size, self.count * 3)
+        full = used // 3
+
+        self._bytes[:full, 2::-1] = channels[:full * 3].reshape(full, 3)
+
+        if full < self.count:
+            self._bytes[full:, :3] = 0
+            tail = channels[full * 3:used]
+            self._bytes[full, 2:2 - tail.size:-1] = tail
+
+        return self.words
+
+
+def _leds_address(strip):
+    """Address of the strip's C LED buffer, None if it can't be reached"""
+    leds = getattr(strip, 'leds', None)  # simulation.PixelStrip
+    if isinstance(leds, np.ndarray):
+        return leds.ctypes.data
+
+    try:
+        import _rpi_ws281x as ws
+        return int(ws.ws2811_channel_t_leds_get(strip._channel))
+    except (ImportError, AttributeError, TypeError):
+        return None
+
+
+class StripWriter:
+    """Writes pixel words into a PixelStrip's LED buffer in one go
+
+    The strip must have been started with begin() before creating the writer.
+    """
+    def __init__(self, strip):
+        self._strip = strip
+        self._count = strip.numPixels()
+        self._address = _leds_address(strip)
+
+    def write(self, first_pixel, words):
+        count = min(len(words), self._count - first_pixel)
+        if count <= 0:
+            return
+
+        if self._address is not None:
+            words = np.ascontiguousarray(words[:count], dtype='<u4')
+            ctypes.memmove(self._address + first_pixel * 4, words.ctypes.data,
+                           words.nbytes)
+        else:
+            self._strip[first_pixel:first_pixel + count] = words[:count].tolist()
@@ -0,0 +1,130 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+# Overdue steps computed, but not shown, per step shown to catch up
+MAX_CATCH_UP = 1
+
+
+class MacroPlayer(threading.Thread):
+    """Plays a macro from its own thread, at the macro's own rate
+
+    Each step is due at an absolute deadline on the monotonic clock, the
+    previous deadline plus the macro's step_length, so the time spent
+    computing and showing frames doesn't add up over the steps. When a
+    step is so late that the next one is already due, up to MAX_CATCH_UP
+    overdue steps are computed but not shown, to catch up. If it is still
+    late, the steps already due are skipped with the macro's skip(), which
+    advances it without drawing them, and counted as skipped steps, so that
+    macros slower to compute than their step_length still run at their
+    true rate. The last step of a macro that doesn't repeat is always shown.
+    If the macro has a ready() method returning False, e.g. a StreamMacro
+    still decoding its next frame, the previous frame is shown again for
+    the step, and counted in `underruns`.
+
+    show: called with each frame to show
+    on_end: called when a macro that doesn't repeat is over
+    metrics: if given, records how late each shown step was as
+             'macro_jitter' and counts skipped steps as 'macro_skipped'
+    """
+    def __init__(self, macro, show, repeat=True, on_end=None, metrics=None):
+        super(MacroPlayer, self).__init__(name='MacroPlayer', daemon=True)
+        self.macro = macro
+        self._show = show
+        self.repeat = repeat
+        self._on_end = on_end
+        self.metrics = metrics
+
+        self._stop_event = threading.Event()
+        self.lateness = 0
+        self.skipped_steps = 0
+        self.underruns = 0
+        self._frame = None
+
+    def stop(self):
+        """Stops the playback, waits for the thread unless called from it"""
+        self._stop_event.set()
+        if threading.current_thread() is not self and self.is_alive():
+            self.join()
+
+    def _next(self):
+        """Next frame, None if the macro is over"""
+        if self._frame is not None and hasattr(self.macro, 'ready') \
+                and not self.macro.ready():
+            self.underruns += 1
+            return self._frame
+        try:
+            self._frame = next(self.macro)
+        except StopIteration:
+            if not self.repeat:
+                return None
+            try:
+                self._frame = next(self.macro)
+            except StopIteration:
+                # Nothing to repeat
+                return None
+        return self._frame
+
+    def _step_length(self):
+        return max(self.macro.step_length, 0) / 1000
+
+    def run(self):
+        deadline = time.monotonic() + self._step_length()
+
+        while not self._stop_event.wait(max(0, deadline - time.monotonic())):
+            now = time.monotonic()
+
+            frame = self._next()
+            next_deadline = deadline + self._step_length()
+
+            skipped = 0
+            ended = frame is None
+            while not ended and next_deadline <= now and skipped < MAX_CATCH_UP \
+                    and not self._stop_event.is_set():
+                following = self._next()
+                if following is None:
+                    # Show the last step anyway
+                    ended = True
+                    break
+                frame = following
+                deadline, next_deadline = next_deadline, \
+                    next_deadline + self._step_length()
+                skipped += 1
+
+            if not ended:
+                # Steps of no length are left to the next iteration
+                while next_deadline <= now and self._step_length() > 0 \
+                        and self.macro.skip():
+                    next_deadline += self._step_length()
+                    skipped += 1
+
+            if frame is not None:
+                self.lateness = now - deadline
+                self.skipped_steps += skipped
+                if self.metrics is not None:
+                    self.metrics.record('macro_jitter', int(self.lateness * 1e9))
+                    if skipped:
+                        self.metrics.count('macro_skipped', skipped)
+
+                self._show(frame)
+
+            if ended:
+                if self._on_end is not None:
+                    self._on_end()
+                return
+            deadline = next_deadline
@@ -0,0 +1,241 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import socket
+import struct
+
+from log import log
+
+E131_PORT = 5568
+ARTNET_PORT = 6454
+
+E131_IDENTIFIER = b'ASC-E1.17\x00\x00\x00'
+E131_ROOT_DATA = 0x00000004
+E131_ROOT_EXTENDED = 0x00000008
+E131_FRAMING_DATA = 0x00000002
+E131_EXTENDED_SYNC = 0x00000001
+E131_STREAM_TERMINATED = 0x40
+E131_DATA_OFFSET = 126
+
+ARTNET_ID = b'Art-Net\x00'
+ARTNET_OP_DMX = 0x5000
+ARTNET_OP_SYNC = 0x5200
+ARTNET_DATA_OFFSET = 18
+
+# Packets whose sequence number is this much behind the last one, or less,
+# are out of order (E1.31 section 6.7.2)
+SEQUENCE_WINDOW = 20
+
+MAX_PACKET_SIZE = 1144
+
+
+def e131_multicast_group(universe):
+    return '239.255.{}.{}'.format(universe >> 8, universe & 0xff)
+
+
+def parse_e131(packet):
+    """Parses an E1.31 packet
+
+    Returns ('data', source, universe, sequence, data), ('sync', source, None,
+    sequence, None) or None if the packet is not to be used.
+    """
+    if len(packet) < 49 or packet[4:16] != E131_IDENTIFIER:
+        return None
+    root_vector, = struct.unpack_from('!I', packet, 18)
+    source = bytes(packet[22:38])
+    framing_vector, = struct.unpack_from('!I', packet, 40)
+
+    if root_vector == E131_ROOT_EXTENDED and framing_vector == E131_EXTENDED_SYNC:
+        return ('sync', source, None, packet[44], None)
+
+    if root_vector != E131_ROOT_DATA or framing_vector != E131_FRAMING_DATA \
+            or len(packet) < E131_DATA_OFFSET:
+        return None
+    sequence, options, universe = struct.unpack_from('!BBH', packet, 111)
+    count, start_code = struct.unpack_from('!HB', packet, 123)
+    if options & E131_STREAM_TERMINATED or start_code != 0:
+        return None
+    return ('data', source, universe, sequence,
+            packet[E131_DATA_OFFSET:E131_DATA_OFFSET + count - 1])
+
+
+def parse_artnet(packet, source):
+    """Parses an Art-Net packet, same return values as parse_e131()"""
+    if len(packet) < 12 or packet[:8] != ARTNET_ID:
+        return None
+    opcode, = struct.unpack_from('<H', packet, 8)
+    if opcode == ARTNET_OP_SYNC:
+        return ('sync', source, None, 0, None)
+    if opcode != ARTNET_OP_DMX or len(packet) < ARTNET_DATA_OFFSET:
+        return None
+    sequence, _, sub_uni, net, length = struct.unpack_from('!BBBBH', packet, 12)
+    return ('data', source, (net << 8) | sub_uni, sequence,
+            packet[ARTNET_DATA_OFFSET:ARTNET_DATA_OFFSET + length])
+
+
+class DMXReceiver:
+    """Receives E1.31 (sACN) and Art-Net without OLA
+
+    Has the same interface as OLA's ClientWrapper and its client, for the
+    parts LEDPanel uses, so it can be given to it as both:
+    LEDPanel(..., wrapper=receiver, client=receiver.Client())
+
+    Universes are the protocols' own numbers: the E1.31 universe, or the
+    Art-Net port address. Registering an universe joins its E1.31
+    multicast group. Everything runs on an asyncio loop, in the thread
+    calling Run(). Each wakeup reads every datagram waiting on the socket,
+    up to `batch` of them, into a reused buffer. The data given to the
+    callbacks is only valid during the call.
+
+    Out of order packets, per source and universe, are dropped.
+    """
+    REGISTER = 1
+    UNREGISTER = 0
+
+    def __init__(self, protocols=('e131', 'artnet'), interface='0.0.0.0',
+                 e131_port=E131_PORT, artnet_port=ARTNET_PORT, batch=64):
+        self.interface = interface
+        self.batch = batch
+        self._loop = asyncio.new_event_loop()
+
+        self._callbacks = {}
+        self._sync_callbacks = []
+        self._sequences = {}
+
+        self.packets = 0
+        self.out_of_order = 0
+
+        self._buffer = bytearray(MAX_PACKET_SIZE)
+        self._view = memoryview(self._buffer)
+        self._sockets = {}
+        if 'e131' in protocols:
+            self._sockets['e131'] = self._openSocket(e131_port)
+        if 'artnet' in protocols:
+            self._sockets['artnet'] = self._openSocket(artnet_port)
+
+    def _openSocket(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.interface, port))
+        sock.setblocking(False)
+        return sock
+
+    @property
+    def ports(self):
+        """Port each protocol is bound to"""
+        return {name: sock.getsockname()[1] for name, sock in self._sockets.items()}
+
+    def _setMembership(self, universe, option):
+        sock = self._sockets.get('e131')
+        if sock is None:
+            return
+        mreq = socket.inet_aton(e131_multicast_group(universe)) + \
+            socket.inet_aton(self.interface)
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, option, mreq)
+        except OSError as e:
+            log.error("Could not change multicast membership for universe {}: {}",
+                      universe, e)
+
+    # OLA client interface
+
+    def Client(self):
+        return self
+
+    def RegisterUniverse(self, universe, action, data_callback=None, callback=None):
+        if action == self.REGISTER:
+            if universe not in self._callbacks:
+                self._setMembership(universe, socket.IP_ADD_MEMBERSHIP)
+            self._callbacks[universe] = data_callback
+        elif self._callbacks.pop(universe, None) is not None:
+            self._setMembership(universe, socket.IP_DROP_MEMBERSHIP)
+        if callback is not None:
+            callback(None)
+        return True
+
+    def RegisterSync(self, callback):
+        """Calls callback() on every E1.31 sync or ArtSync packet"""
+        self._sync_callbacks.append(callback)
+
+    # OLA ClientWrapper interface
+
+    def AddEvent(self, time_in_ms, callback):
+        self._loop.call_later(time_in_ms / 1000, callback)
+
+    def Execute(self, f):
+        self._loop.call_soon_threadsafe(f)
+
+    def Run(self):
+        asyncio.set_event_loop(self._loop)
+        for name, sock in self._sockets.items():
+            self._loop.add_reader(sock, self._read, name, sock)
+        try:
+            self._loop.run_forever()
+        finally:
+            for sock in self._sockets.values():
+                self._loop.remove_reader(sock)
+
+    def Stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def close(self):
+        for sock in self._sockets.values():
+            sock.close()
+        self._loop.close()
+
+    # Reception
+
+    def _read(self, name, sock):
+        for _ in range(self.batch):
+            try:
+                size, address = sock.recvfrom_into(self._buffer)
+            except BlockingIOError:
+                return
+            self.handlePacket(name, self._view[:size], address[0])
+
+    def handlePacket(self, protocol, packet, address):
+        """Handles one packet of `protocol`, 'e131' or 'artnet'"""
+        if protocol == 'e131':
+            parsed = parse_e131(packet)
+        else:
+            parsed = parse_artnet(packet, address)
+        if parsed is None:
+            return
+        kind, source, universe, sequence, data = parsed
+        self.packets += 1
+
+        if kind == 'sync':
+            for callback in self._sync_callbacks:
+                callback()
+            return
+
+        callback = self._callbacks.get(universe)
+        if callback is None:
+            return
+
+        # Art-Net sequence 0 means sequencing is disabled
+        if protocol == 'e131' or sequence != 0:
+            key = (source, universe)
+            last = self._sequences.get(key)
+            if last is not None:
+                difference = ((sequence - last + 128) & 0xff) - 128
+                if -SEQUENCE_WINDOW < difference <= 0:
+                    self.out_of_order += 1
+                    return
+            self._sequences[key] = sequence
+
+        callback(data)
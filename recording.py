@@ -0,0 +1,214 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import struct
+import threading
+import time
+
+import numpy as np
+
+# magic, version
+RECORDING_HEADER = struct.Struct('<4sH')
+RECORDING_MAGIC = b'LPDR'
+RECORDING_VERSION = 1
+# monotonic time in ns, universe, first changed channel, changed channel count,
+# followed by the channels from the first changed one to the last one
+RECORD_HEADER = struct.Struct('<QHHH')
+# Universe of the empty record starting each recording session, the
+# monotonic clock being unrelated from one session to the next
+SESSION_MARKER = 0xffff
+
+UNIVERSE_SIZE = 512
+
+
+class DMXRecorder:
+    """Appends the DMX received by a panel to a binary log
+
+    Each record only holds the channels that changed in its universe since
+    the previous packet, from the first changed one to the last one.
+    Packets changing nothing are not recorded. Each recorder starts a new
+    session with a SESSION_MARKER record, so that recording again to the
+    same file, even after a reboot, plays right after the previous
+    session. record() and close() can be called from different threads.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION))
+        self._file.write(RECORD_HEADER.pack(time.monotonic_ns(), SESSION_MARKER, 0, 0))
+        self._universes = {}
+        self.records = 0
+
+    def record(self, universe, data):
+        channels = np.zeros(UNIVERSE_SIZE, dtype=np.uint8)
+        data = np.asarray(data, dtype=np.uint8)[:UNIVERSE_SIZE]
+        channels[:data.size] = data
+
+        last = self._universes.get(universe)
+        if last is None:
+            last = self._universes[universe] = np.zeros(UNIVERSE_SIZE, dtype=np.uint8)
+        changed = np.flatnonzero(channels != last)
+        if changed.size == 0:
+            return
+        first, end = int(changed[0]), int(changed[-1]) + 1
+
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(RECORD_HEADER.pack(time.monotonic_ns(), universe, first,
+                                                end - first))
+            self._file.write(channels[first:end].tobytes())
+        last[first:end] = channels[first:end]
+        self.records += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class DMXRecording:
+    """Reads a log written by DMXRecorder from a memory map
+
+    recording[i] is (time in ns, universe, first channel, channels), the
+    channels being a view into the file. The times of each session are
+    shifted to start where the previous session ended.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._data = np.memmap(path, dtype=np.uint8, mode='r')
+        magic, version = RECORDING_HEADER.unpack_from(self._data, 0)
+        if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+            raise ValueError('{} is not a DMX recording'.format(path))
+
+        times, universes, firsts, offsets, counts = [], [], [], [], []
+        offset = RECORDING_HEADER.size
+        size = self._data.size
+        shift = 0
+        while offset + RECORD_HEADER.size <= size:
+            timestamp, universe, first, count = RECORD_HEADER.unpack_from(
+                self._data, offset)
+            offset += RECORD_HEADER.size
+            if offset + count > size:
+                # last record cut short
+                break
+            if universe == SESSION_MARKER:
+                shift = (times[-1] if times else 0) - timestamp
+                continue
+            times.append(timestamp + shift)
+            universes.append(universe)
+            firsts.append(first)
+            offsets.append(offset)
+            counts.append(count)
+            offset += count
+
+        self.times = np.array(times, dtype=np.int64)
+        self.universes = np.array(universes, dtype=np.uint16)
+        self._firsts = firsts
+        self._offsets = offsets
+        self._counts = counts
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, i):
+        offset = self._offsets[i]
+        return (int(self.times[i]), int(self.universes[i]), self._firsts[i],
+                self._data[offset:offset + self._counts[i]])
+
+    @property
+    def duration(self):
+        """Time between the first and the last record, in s"""
+        return (self.times[-1] - self.times[0]) / 1e9 if len(self) else 0
+
+
+class DMXReplay:
+    """Replays a DMXRecording, played by a MacroPlayer like a macro
+
+    Records are due at their recorded times divided by `speed`. Showing a
+    step calls send(universe, channels) with the whole universe, for each
+    universe changed since the previous step shown, so that the steps the
+    player skips to catch up are not lost:
+    replay = DMXReplay(recording, panel.injectDMX)
+    MacroPlayer(replay, replay.show)
+    panel.injectDMX() hands the universes to the panel's wrapper thread, so
+    they are handled there like the DMX received.
+    """
+    def __init__(self, recording, send, speed=1):
+        self.recording = recording
+        self.send = send
+        self.speed = speed
+        self.index = 0
+        self._universes = {}
+        self._changed = set()
+
+    def __iter__(self):
+        return self
+
+    def __len__(self):
+        return len(self.recording)
+
+    def __next__(self):
+        if self.index == len(self):
+            self.index = 0
+            raise StopIteration
+
+        _, universe, first, channels = self.recording[self.index]
+        data = self._universes.get(universe)
+        if data is None:
+            data = self._universes[universe] = np.zeros(UNIVERSE_SIZE, dtype=np.uint8)
+        data[first:first + channels.size] = channels
+        self._changed.add(universe)
+
+        self.index += 1
+        return self._changed
+
+    def show(self, changed):
+        """Sends the universes changed since the last call"""
+        for universe in sorted(changed):
+            self.send(universe, self._universes[universe])
+        changed.clear()
+
+    def skip(self):
+        """Applies the next record without sending it, False at the end"""
+        if self.index == len(self):
+            return False
+        next(self)
+        return True
+
+    def reset(self):
+        self.index = 0
+        self._universes.clear()
+        self._changed.clear()
+
+    @property
+    def step_length(self):
+        """Time between the previous record and the next one, in ms"""
+        if self.index == 0 or self.index == len(self):
+            return 0
+        times = self.recording.times
+        return (times[self.index] - times[self.index - 1]) / 1e6 / self.speed
+
+
+def replay(recording, send):
+    """Calls send(universe, channels) for every record of `recording` as fast
+    as possible, returns the time it took in s"""
+    steps = DMXReplay(recording, send)
+    start = time.perf_counter()
+    for changed in steps:
+        steps.show(changed)
+    return time.perf_counter() - start
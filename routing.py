@@ -0,0 +1,74 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from dataclasses import dataclass
+
+from backends import DMX_UNIVERSE_SIZE
+
+PACKINGS = ('rows', 'pixels')
+
+
+@dataclass(frozen=True)
+class Route:
+    """Part of the image carried by an universe
+
+    The channels first_channel to last_channel, excluded, hold the
+    pixel_count pixels starting at first_pixel. Channels start at 0.
+    """
+    first_channel: int
+    last_channel: int
+    first_pixel: int
+    pixel_count: int
+
+
+def compile_routes(start_universe, start_channel, columns, rows, channels_per_pixel=3,
+                   packing='rows'):
+    """Returns {universe: Route} for a `columns`x`rows` image starting at
+    `start_channel`, from 0, of `start_universe`, in universe order
+
+    packing: 'rows' never splits a row between universes, the channels left
+             at the end of an universe are unused. 'pixels' fills each
+             universe with as many whole pixels as fit, rows cross the
+             universe boundaries.
+
+    The first universe is always routed, even when nothing fits in it.
+    """
+    if packing not in PACKINGS:
+        raise ValueError('packing must be one of {}'.format(', '.join(PACKINGS)))
+    if not 0 <= start_channel < DMX_UNIVERSE_SIZE:
+        raise ValueError('start_channel must be between 0 and {}'.format(
+            DMX_UNIVERSE_SIZE - 1))
+
+    # Pixels never split between universes
+    unit = columns if packing == 'rows' else 1
+    if unit * channels_per_pixel > DMX_UNIVERSE_SIZE:
+        raise ValueError('a row of {} channels does not fit in an universe, use the '
+                         "'pixels' packing".format(unit * channels_per_pixel))
+
+    pixel_total = columns * rows
+    routes = {}
+    universe, channel, pixel = start_universe, start_channel, 0
+    while True:
+        fitting = (DMX_UNIVERSE_SIZE - channel) // (unit * channels_per_pixel) * unit
+        count = min(fitting, pixel_total - pixel)
+        routes[universe] = Route(channel, channel + count * channels_per_pixel,
+                                 pixel, count)
+        pixel += count
+        if pixel >= pixel_total:
+            return routes
+        universe += 1
+        channel = 0
@@ -0,0 +1,372 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+import heapq
+import itertools
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+DMX_UNIVERSE_SIZE = 512
+
+# Same fields as RPLCD.lcd.LCDConfig
+LCDConfig = namedtuple('LCDConfig', 'rows cols dotsize')
+
+
+class PixelStrip:
+    """Same interface as rpi_ws281x.PixelStrip, without the LEDs
+
+    If `realtime` is set, show() takes as long as sending the data over a
+    WS281x bus would.
+    """
+    def __init__(self, num, pin, freq_hz=800000, dma=10, invert=False,
+                 brightness=255, channel=0, strip_type=None, gamma=None,
+                 realtime=True):
+        self.num = num
+        self.pin = pin
+        self.channel = channel
+        self.brightness = brightness
+        self.realtime = realtime
+        # 24 bits per LED, then the 50 us reset
+        self.wire_time = num * 24 / freq_hz + 50e-6
+
+        self.leds = np.zeros(num, dtype='<u4')
+        self.shown = np.zeros(num, dtype='<u4')
+        self.show_count = 0
+
+    def begin(self):
+        pass
+
+    def show(self):
+        np.copyto(self.shown, self.leds)
+        self.show_count += 1
+        if self.realtime:
+            time.sleep(self.wire_time)
+
+    def setPixelColor(self, n, color):
+        self.leds[n] = color
+
+    def setPixelColorRGB(self, n, red, green, blue, white=0):
+        self.leds[n] = (white << 24) | (red << 16) | (green << 8) | blue
+
+    def getPixelColor(self, n):
+        return int(self.leds[n])
+
+    def __getitem__(self, pos):
+        return self.leds[pos]
+
+    def __setitem__(self, pos, value):
+        self.leds[pos] = value
+
+    def setBrightness(self, brightness):
+        self.brightness = brightness
+
+    def getBrightness(self):
+        return self.brightness
+
+    def numPixels(self):
+        return self.num
+
+
+class _GPIO:
+    """Same interface as the RPi.GPIO module
+
+    Pins keep the last value written to them, inputs can be driven with
+    press() and release().
+    """
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.pins = {}
+        self._callbacks = {}
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=LOW):
+        if direction == self.IN:
+            self.pins[pin] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+        else:
+            self.pins[pin] = initial
+
+    def output(self, pin, value):
+        self.pins[pin] = value
+
+    def input(self, pin):
+        return self.pins.get(pin, self.LOW)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self._callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin):
+        self._callbacks.pop(pin, None)
+
+    def cleanup(self, pin=None):
+        if pin is None:
+            self.pins.clear()
+            self._callbacks.clear()
+        else:
+            self.pins.pop(pin, None)
+            self._callbacks.pop(pin, None)
+
+    def _set(self, pin, value):
+        last = self.pins.get(pin, self.LOW)
+        self.pins[pin] = value
+        edge, callback = self._callbacks.get(pin, (None, None))
+        if callback is None or last == value:
+            return
+        if (edge == self.BOTH or (edge == self.RISING and value == self.HIGH)
+                or (edge == self.FALLING and value == self.LOW)):
+            callback(pin)
+
+    def press(self, pin):
+        """Pulls a pulled-up button pin to the ground"""
+        self._set(pin, self.LOW)
+
+    def release(self, pin):
+        self._set(pin, self.HIGH)
+
+
+GPIO = _GPIO()
+
+
+class CharLCD:
+    """Same interface as RPLCD.i2c.CharLCD, keeping the text in memory
+
+    `write_count` counts the characters and commands sent to the LCD.
+    """
+    def __init__(self, i2c_expander='PCF8574', address=0x27, port=1, cols=20,
+                 rows=4, dotsize=8, auto_linebreaks=True, backlight_enabled=True,
+                 **kwargs):
+        self.lcd = LCDConfig(rows=rows, cols=cols, dotsize=dotsize)
+        self.auto_linebreaks = auto_linebreaks
+        self.backlight_enabled = backlight_enabled
+        self.cursor_mode = 'hide'
+        self.characters = {}
+
+        self.write_count = 0
+        self._row = 0
+        self._col = 0
+        self.lines = [[' '] * cols for _ in range(rows)]
+
+    @property
+    def cursor_pos(self):
+        return (self._row, self._col)
+
+    @cursor_pos.setter
+    def cursor_pos(self, value):
+        self.write_count += 1
+        self._row, self._col = value
+
+    def clear(self):
+        self.write_count += 1
+        self.lines = [[' '] * self.lcd.cols for _ in range(self.lcd.rows)]
+        self._row = self._col = 0
+
+    def home(self):
+        self.write_count += 1
+        self._row = self._col = 0
+
+    def crlf(self):
+        self.write_count += 1
+        self._row = (self._row + 1) % self.lcd.rows
+        self._col = 0
+
+    def write_string(self, value):
+        for char in value:
+            self.write_count += 1
+            if self._col < self.lcd.cols:
+                self.lines[self._row][self._col] = char
+            self._col += 1
+
+    def create_char(self, location, bitmap):
+        self.write_count += 9
+        self.characters[location] = bitmap
+
+    def close(self, clear=False):
+        if clear:
+            self.clear()
+
+    @property
+    def text(self):
+        return [''.join(line) for line in self.lines]
+
+
+class _SelectServer:
+    """Runs callbacks and timed events on the thread calling Run()"""
+    def __init__(self):
+        self._events = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._running = False
+
+    def AddEvent(self, time_in_ms, callback):
+        with self._condition:
+            heapq.heappush(self._events, (time.monotonic() + time_in_ms / 1000,
+                                          next(self._counter), callback))
+            self._condition.notify()
+
+    def Execute(self, f):
+        self.AddEvent(0, f)
+
+    def Run(self):
+        self._running = True
+        while self._running:
+            with self._condition:
+                if not self._events:
+                    self._condition.wait()
+                    continue
+                deadline, _, callback = self._events[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._events)
+            callback()
+
+    def Terminate(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+
+class OlaClient:
+    """Same interface as ola.OlaClient.OlaClient for universe registration
+
+    send() calls the universe's data callback on the caller's thread.
+    """
+    REGISTER = 1
+    UNREGISTER = 0
+
+    def __init__(self):
+        self.universes = {}
+        self.rpc_count = 0
+
+    def RegisterUniverse(self, universe, action, data_callback=None, callback=None):
+        self.rpc_count += 1
+        if action == self.REGISTER:
+            self.universes[universe] = data_callback
+        else:
+            self.universes.pop(universe, None)
+        if callback is not None:
+            callback(None)
+        return True
+
+    def send(self, universe, data):
+        callback = self.universes.get(universe)
+        if callback is not None:
+            callback(data)
+
+
+class ClientWrapper:
+    """Same interface as ola.ClientWrapper.ClientWrapper"""
+    def __init__(self, socket=None):
+        self._ss = _SelectServer()
+        self._client = OlaClient()
+
+    def Client(self):
+        return self._client
+
+    def Run(self):
+        self._ss.Run()
+
+    def Stop(self):
+        self._ss.Terminate()
+
+    def AddEvent(self, time_in_ms, callback):
+        self._ss.AddEvent(time_in_ms, callback)
+
+
+class DMXSender:
+    """Sends E1.31 and Art-Net packets, a stand-in for a lighting console
+
+    Sends to `host` by unicast, e.g. to a receiver.DMXReceiver on the same
+    machine.
+    """
+    def __init__(self, host='127.0.0.1', e131_port=5568, artnet_port=6454,
+                 cid=b'ledpanel-sender!', name='LED Panel simulation'):
+        self.host = host
+        self.e131_port = e131_port
+        self.artnet_port = artnet_port
+        self.cid = cid[:16].ljust(16, b'\x00')
+        self.name = name.encode()[:63].ljust(64, b'\x00')
+        self.sequences = {}
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _nextSequence(self, key):
+        sequence = self.sequences[key] = (self.sequences.get(key, -1) + 1) & 0xff
+        return sequence
+
+    def e131Packet(self, universe, data, sequence=None, priority=100, sync_address=0):
+        data = bytes(data)
+        if sequence is None:
+            sequence = self._nextSequence(('e131', universe))
+        length = 126 + len(data)
+        return b''.join((
+            struct.pack('!HH12sHI16s', 0x0010, 0, b'ASC-E1.17\x00\x00\x00',
+                        0x7000 | (length - 16), 0x00000004, self.cid),
+            struct.pack('!HI64sBHBBH', 0x7000 | (length - 38), 0x00000002, self.name,
+                        priority, sync_address, sequence, 0, universe),
+            struct.pack('!HBBHHHB', 0x7000 | (length - 115), 0x02, 0xa1, 0, 1,
+                        len(data) + 1, 0),
+            data))
+
+    def e131SyncPacket(self, sync_address=1):
+        sequence = self._nextSequence(('e131', 'sync'))
+        return struct.pack('!HH12sHI16sHIBHH', 0x0010, 0, b'ASC-E1.17\x00\x00\x00',
+                           0x7000 | 33, 0x00000008, self.cid, 0x7000 | 11,
+                           0x00000001, sequence, sync_address, 0)
+
+    def artnetPacket(self, universe, data, sequence=None):
+        data = bytes(data)
+        if sequence is None:
+            # 0 disables sequencing in Art-Net
+            sequence = self._nextSequence(('artnet', universe)) % 255 + 1
+        return b''.join((
+            struct.pack('<8sH', b'Art-Net\x00', 0x5000),
+            struct.pack('!HBBBBH', 14, sequence, 0, universe & 0xff, universe >> 8,
+                        len(data)),
+            data))
+
+    def sendE131(self, universe, data, sequence=None):
+        self._socket.sendto(self.e131Packet(universe, data, sequence),
+                            (self.host, self.e131_port))
+
+    def sendE131Sync(self, sync_address=1):
+        self._socket.sendto(self.e131SyncPacket(sync_address),
+                            (self.host, self.e131_port))
+
+    def sendArtNet(self, universe, data, sequence=None):
+        self._socket.sendto(self.artnetPacket(universe, data, sequence),
+                            (self.host, self.artnet_port))
+
+    def close(self):
+        self._socket.close()
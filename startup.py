@@ -0,0 +1,82 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import threading
+import time
+
+from log import log
+
+
+class StartupTimer:
+    """Times the startup phases and runs the independent ones concurrently
+
+    with startup.phase('lcd'):
+        ...
+    results = startup.parallel(strip=begin_strip, ola=connect)
+    """
+    def __init__(self):
+        self.start = time.perf_counter_ns()
+        # name -> (start, end) in ns since self.start
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            with self._lock:
+                self.phases[name] = (start - self.start, end - self.start)
+
+    def parallel(self, **steps):
+        """Calls each step in its own thread, each one timed as a phase of
+        the same name, and returns {name: returned value}
+
+        Raises the exception of the first step that failed, once they have
+        all ended.
+        """
+        results = {}
+        errors = []
+
+        def run(name, step):
+            try:
+                with self.phase(name):
+                    results[name] = step()
+            except BaseException as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=item, name='Startup-' + item[0])
+                   for item in steps.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    def report(self, metrics=None):
+        """Logs the phases, records them in `metrics` as startup_<name>"""
+        for name, (start, end) in sorted(self.phases.items(), key=lambda item: item[1]):
+            log.info("Startup: {} {:.1f} ms (from {:.1f} ms)",
+                     name, (end - start) / 1e6, start / 1e6)
+            if metrics is not None:
+                metrics.record('startup_' + name, end - start)
+        log.info("Startup: ready in {:.1f} ms",
+                 (time.perf_counter_ns() - self.start) / 1e6)
@@ -0,0 +1,66 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Checks ShadowLCD against the real RPLCD interface, with no LCD attached.
+# Run with python3 -m pytest, or python3 test_display.py
+
+import pytest
+
+from display import ShadowLCD
+
+lcd = pytest.importorskip('RPLCD.lcd')
+common = pytest.importorskip('RPLCD.common')
+
+
+class MemoryCharLCD(lcd.BaseCharLCD):
+    """RPLCD CharLCD sending its data to a list instead of the bus"""
+    data_bus_mode = common.LCD_4BITMODE
+
+    def __init__(self, cols=20, rows=4):
+        self.sent = []
+        super(MemoryCharLCD, self).__init__(cols=cols, rows=rows)
+
+    def _init_connection(self):
+        pass
+
+    def _close_connection(self):
+        pass
+
+    def _send_data(self, value):
+        self.sent.append(value)
+
+    def _send_instruction(self, value):
+        pass
+
+
+def test_write_uses_the_rplcd_size():
+    """The lines are cut and padded to the LCD's size, and only the
+    changed cells are sent again"""
+    memory_lcd = MemoryCharLCD(cols=16, rows=2)
+    display = ShadowLCD(memory_lcd)
+    display.write('a' * 20, 'b', 'c')
+    display.flush()
+    assert bytes(memory_lcd.sent) == b'a' * 16 + b'b'
+
+    memory_lcd.sent.clear()
+    display.write('a' * 20, 'x')
+    display.flush()
+    assert bytes(memory_lcd.sent) == b'x'
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
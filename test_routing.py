@@ -0,0 +1,152 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Checks the universe routing of every start channel, for panels up to 64x64.
+# Run with python3 -m pytest, or python3 test_routing.py
+
+import itertools
+import os
+import threading
+
+os.environ.setdefault('LEDPANEL_SIMULATE', 'all')
+
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+
+from LedPanel import LEDPanel  # noqa: E402
+from palette import Palette  # noqa: E402
+from routing import PACKINGS, compile_routes  # noqa: E402
+
+MAX_SIZE = 64
+PANEL_SIZES = ((1, 1), (17, 17), (64, 64), (170, 3))
+
+
+def encode_image(image, universe, channel, packing):
+    """DMX data of each universe carrying `image`, a (rows, columns,
+    channels per pixel) array, starting at `channel`, from 0, of `universe`
+
+    Written independently of routing.py to check it.
+    """
+    rows, columns, channels_per_pixel = image.shape
+    universes = {universe: np.zeros(512, dtype=np.uint8)}
+    step = columns if packing == 'rows' else 1
+    size = step * channels_per_pixel
+    pixels = image.reshape(-1, channels_per_pixel)
+    for pixel in range(0, rows * columns, step):
+        if channel + size > 512:
+            universe += 1
+            channel = 0
+            universes[universe] = np.zeros(512, dtype=np.uint8)
+        universes[universe][channel:channel + size] = \
+            pixels[pixel:pixel + step].reshape(-1)
+        channel += size
+    return universes
+
+
+def check_routes(routes, universe, channel, columns, rows, channels_per_pixel, packing):
+    """Returns what is wrong with `routes`, see routing.compile_routes()"""
+    errors = []
+    total = columns * rows
+    unit = columns if packing == 'rows' else 1
+    unit_size = unit * channels_per_pixel
+    in_first = (512 - channel) // unit_size * unit
+    per_universe = 512 // unit_size * unit
+    expected = 1 + max(-(-(total - in_first) // per_universe), 0)
+    if list(routes) != list(range(universe, universe + expected)):
+        errors.append('universes {} instead of {} from {}'.format(
+            list(routes), expected, universe))
+
+    pixel = 0
+    for uni, route in routes.items():
+        first = channel if uni == universe else 0
+        if route.first_channel != first:
+            errors.append('universe {} starts at channel {}'.format(
+                uni, route.first_channel))
+        if route.first_pixel != pixel:
+            errors.append('universe {} starts at pixel {} instead of {}'.format(
+                uni, route.first_pixel, pixel))
+        if route.last_channel - route.first_channel != \
+                route.pixel_count * channels_per_pixel or route.last_channel > 512:
+            errors.append('universe {} has channels {} to {} for {} pixels'.format(
+                uni, route.first_channel, route.last_channel, route.pixel_count))
+        if route.first_pixel % unit or route.pixel_count % unit:
+            errors.append('universe {} splits a row'.format(uni))
+        pixel += route.pixel_count
+        if pixel < total and 512 - route.last_channel >= unit_size:
+            errors.append('universe {} is not full'.format(uni))
+    if pixel != total:
+        errors.append('{} pixels routed instead of {}'.format(pixel, total))
+    return errors
+
+
+@pytest.mark.parametrize('packing', PACKINGS)
+@pytest.mark.parametrize('channels_per_pixel', (3, 1))
+def test_routes(packing, channels_per_pixel):
+    errors = []
+    for size, channel in itertools.product(range(1, MAX_SIZE + 1), range(512)):
+        routes = compile_routes(1, channel, size, size, channels_per_pixel, packing)
+        for error in check_routes(routes, 1, channel, size, size,
+                                  channels_per_pixel, packing):
+            errors.append('{0}x{0} @{1}: {2}'.format(size, channel + 1, error))
+    assert errors == []
+
+
+def test_rows_wider_than_an_universe():
+    with pytest.raises(ValueError):
+        compile_routes(1, 0, 171, 1, 3, 'rows')
+    assert len(compile_routes(1, 0, 171, 1, 3, 'pixels')) == 2
+
+
+def show_injected(panel):
+    """Shows the frame injected so far, waits for it to be handled"""
+    handled = threading.Event()
+    # The hold time may have split the frame, close its last part
+    panel._wrapper.Execute(panel.assembler.sync)
+    panel._wrapper.Execute(handled.set)
+    handled.wait()
+
+
+@pytest.mark.parametrize('columns, rows', PANEL_SIZES)
+@pytest.mark.parametrize('packing', PACKINGS)
+@pytest.mark.parametrize('palette', (False, True))
+def test_panel_receives_image(columns, rows, packing, palette):
+    """The image sent at every start channel is the one received"""
+    panel = LEDPanel(universe=1, channel=1, columns=columns, rows=rows, fps=1000,
+                     palette=Palette() if palette else None, packing=packing)
+    wrapper_thread = threading.Thread(target=panel.run, daemon=True)
+    wrapper_thread.start()
+
+    errors = []
+    try:
+        for channel in range(1, 513):
+            panel.setAddress(1, channel)
+            image = np.random.randint(0, 256, (rows, columns, 1 if palette else 3),
+                                      dtype=np.uint8)
+            for uni, data in encode_image(image, 1, channel - 1, packing).items():
+                panel.injectDMX(uni, data)
+            show_injected(panel)
+            received = panel._indices if palette else panel.live_layer.pixels
+            if not np.array_equal(received.reshape(image.shape), image):
+                errors.append('wrong pixels received at channel {}'.format(channel))
+    finally:
+        panel.stop()
+        wrapper_thread.join()
+    assert errors == []
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__]))
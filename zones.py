@@ -0,0 +1,73 @@
+# LED Panel
+# Copyright (C) 2019 Nils VAN ZUIJLEN
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from dataclasses import dataclass
+
+import numpy as np
+
+GROUPINGS = ('blocks', 'rows', 'columns', 'mask')
+
+
+@dataclass(frozen=True)
+class Zones:
+    """How the pixels of a panel are grouped into zones of one color each
+
+    grouping: One of GROUPINGS: blocks of block_width x block_height
+              pixels, whole rows, whole columns, or the zones of a mask file
+    block_width, block_height: Size of the blocks. The last blocks of each
+                               row and column are cut by the panel's edges.
+    mask: Path of a text file holding the zone number of each pixel, one
+          row of the image per line. Zones are ordered by their numbers.
+    """
+    grouping: str = 'blocks'
+    block_width: int = 1
+    block_height: int = 1
+    mask: str = None
+
+    def __post_init__(self):
+        if self.grouping not in GROUPINGS:
+            raise ValueError('grouping must be one of {}'.format(', '.join(GROUPINGS)))
+        if self.grouping == 'mask' and self.mask is None:
+            raise ValueError('the mask grouping needs a mask file')
+
+    def compile(self, columns, rows):
+        """Returns (table, zone_columns, zone_rows) for a `columns`x`rows` image
+
+        The table holds, for each pixel of the image, the index of its zone,
+        so that image = zone_colors[table]. The zones are received as a
+        `zone_columns`x`zone_rows` image.
+        """
+        if self.grouping == 'blocks':
+            zone_columns = -(-columns // self.block_width)
+            zone_rows = -(-rows // self.block_height)
+            table = (np.arange(rows)[:, np.newaxis] // self.block_height * zone_columns
+                     + np.arange(columns)[np.newaxis, :] // self.block_width)
+        elif self.grouping == 'rows':
+            zone_columns, zone_rows = 1, rows
+            table = np.repeat(np.arange(rows), columns)
+        elif self.grouping == 'columns':
+            zone_columns, zone_rows = columns, 1
+            table = np.tile(np.arange(columns), rows)
+        else:
+            mask = np.loadtxt(self.mask, dtype=np.int64, ndmin=2)
+            if mask.shape != (rows, columns):
+                raise ValueError('{} is {}x{}, the panel is {}x{}'.format(
+                    self.mask, mask.shape[1], mask.shape[0], columns, rows))
+            _, table = np.unique(mask, return_inverse=True)
+            # one zone per row, so that a zone is never split between universes
+            zone_columns, zone_rows = 1, int(table.max()) + 1
+
+        return table.reshape(-1).astype(np.intp), zone_columns, zone_rows